@@ -0,0 +1,158 @@
+import os
+import struct
+import threading
+
+import pygame
+
+import constants as c
+import fonts
+
+
+__all__ = ["image", "sound", "font", "preload"]
+
+
+# Everything the game loads, decoded ahead of time by preload
+IMAGES = ["archway.png", "background_layer_1.png", "background_layer_2.png", "background_layer_2.5.png",
+          "background_layer_3.png", "big_lantern.png", "big_lantern_touched.png", "good.png",
+          "lantern.png", "lantern_touched.png", "nope.png", "okay.png", "perfect.png", "player.png",
+          "pointer.png", "pointer_missing.png", "score_background.png", "small_lantern.png",
+          "small_lantern_touched.png", "title.png", "tutorial_clicked.png", "tutorial_unclicked.png",
+          "wall_texture.png", "wing.png", "wing_gauge.png", "wing_gauge_100.png", "wing_gauge_full.png"]
+SOUNDS = ["bad_tear1.wav", "bad_tear2.wav", "bounce_wall.wav", "dashing.wav", "explosion.wav",
+          "fifths.wav", "luminary.wav", "nope.wav", "reset.wav", "sus.wav", "tear1.wav", "tear2.wav",
+          "tear3.wav", "tear4.wav", "type.wav", "wings_charged.wav", "wings_used.wav"]
+
+image_header = struct.Struct("!qqIIB")    # source mtime, source size, width, height, has alpha
+sound_header = struct.Struct("!qqiii")    # source mtime, source size, frequency, format, channels
+
+# Decoded assets, filled from any thread under the lock
+decoded = {}
+decode_lock = threading.Lock()
+
+# Images converted to the display format, and scaled copies of them. Only touched on the main thread.
+images = {}
+
+
+def source_path(name):
+    return os.path.join(c.ASSETS_PATH, name)
+
+
+def cache_path(name):
+    return os.path.join(c.ASSET_CACHE_PATH, name + ".raw")
+
+
+def source_stamp(name):
+    stat = os.stat(source_path(name))
+    return stat.st_mtime_ns, stat.st_size
+
+
+def read_cache(name, header):
+    """ Returns the header fields and payload of a cache entry, or None if it is missing or stale. """
+    try:
+        with open(cache_path(name), "rb") as f:
+            data = f.read()
+        fields = header.unpack_from(data)
+    except (OSError, struct.error):
+        return None
+    if fields[:2] != source_stamp(name):
+        return None
+    return fields, data[header.size:]
+
+
+def write_cache(name, header_bytes, payload):
+    """ Writes a cache entry atomically. The cache is only an optimization, so failures are ignored. """
+    path = cache_path(name)
+    try:
+        os.makedirs(c.ASSET_CACHE_PATH, exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(header_bytes)
+            f.write(payload)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+
+def decode_image(name):
+    cached = read_cache(name, image_header)
+    if cached is not None:
+        (_, _, width, height, alpha), pixels = cached
+        return pygame.image.frombytes(pixels, (width, height), "RGBA" if alpha else "RGB")
+    surf = pygame.image.load(source_path(name))
+    if surf.get_colorkey() is not None:
+        # Paletted images key out one palette index, which raw RGB can't express. They're small
+        # enough to decode every time.
+        return surf
+    alpha = bool(surf.get_flags() & pygame.SRCALPHA)
+    mode = "RGBA" if alpha else "RGB"
+    write_cache(name, image_header.pack(*source_stamp(name), *surf.get_size(), alpha),
+                pygame.image.tobytes(surf, mode))
+    return surf
+
+
+def decode_sound(name):
+    mixer_format = pygame.mixer.get_init()
+    cached = read_cache(name, sound_header)
+    if cached is not None and tuple(cached[0][2:]) == mixer_format:
+        return pygame.mixer.Sound(buffer=cached[1])
+    sound = pygame.mixer.Sound(source_path(name))
+    write_cache(name, sound_header.pack(*source_stamp(name), *mixer_format), sound.get_raw())
+    return sound
+
+
+def get_decoded(name, decode):
+    with decode_lock:
+        if name not in decoded:
+            decoded[name] = decode(name)
+        return decoded[name]
+
+
+def image(name, scale=1):
+    """ Returns the image from the assets folder, converted to the display format once a display
+        exists. The surface is shared, so copy it before drawing on it.
+    """
+    key = (name, scale)
+    if key in images:
+        return images[key]
+    surf = get_decoded(name, decode_image)
+    if scale != 1:
+        surf = pygame.transform.scale(surf, (surf.get_width()*scale, surf.get_height()*scale))
+    if pygame.display.get_surface() is None:
+        return surf
+    if surf.get_flags() & pygame.SRCALPHA:
+        surf = surf.convert_alpha()
+    else:
+        surf = surf.convert()
+    images[key] = surf
+    return surf
+
+
+def sound(name):
+    """ Returns the sound from the assets folder. The Sound is shared, volume included. """
+    return get_decoded(name, decode_sound)
+
+
+def font(name, size):
+    return fonts.get_font(name, size)
+
+
+def preload(image_names=IMAGES, sound_names=SOUNDS):
+    """ Decodes assets on a background thread, so that later calls to image and sound find them
+        ready. Returns the thread.
+    """
+    def load_all():
+        # Failures are left for the main thread to raise when it asks for the asset
+        for name in image_names:
+            try:
+                get_decoded(name, decode_image)
+            except (OSError, pygame.error):
+                pass
+        if pygame.mixer.get_init():
+            for name in sound_names:
+                try:
+                    get_decoded(name, decode_sound)
+                except (OSError, pygame.error):
+                    pass
+
+    thread = threading.Thread(target=load_all, daemon=True)
+    thread.start()
+    return thread
@@ -1,10 +1,14 @@
 import pygame
 import constants as c
-import os
+import assets
 
 
 class Background:
 
+    padding = 20
+    slowness = 10
+    navy = (19, 29, 71)
+
     def __init__(self, game):
         self.game = game
 
@@ -12,51 +16,85 @@ class Background:
         self.gray_rect.fill(c.WHITE)
         self.gray_rect.set_alpha(20)
 
-        self.layer_1 = pygame.image.load(os.path.join(c.ASSETS_PATH, "background_layer_1.png"))
-        self.layer_2 = pygame.image.load(os.path.join(c.ASSETS_PATH, "background_layer_2.png"))
-        self.layer_2_5 = pygame.image.load(os.path.join(c.ASSETS_PATH, "background_layer_2.5.png"))
-        self.layer_3 = pygame.image.load(os.path.join(c.ASSETS_PATH, "background_layer_3.png"))
+        self.layer_1 = assets.image("background_layer_1.png")
+        self.layer_2 = assets.image("background_layer_2.png")
+        self.layer_2_5 = assets.image("background_layer_2.5.png")
+        self.layer_3 = assets.image("background_layer_3.png")
+
+        # The layers only move a pixel every few frames, so the column is composited in stages that
+        # are kept between frames: layer 3 alone, then with each nearer layer over it in turn. When a
+        # layer moves, only its stage and the ones in front of it are redrawn, and layer 3, which is
+        # opaque, is scrolled in place with only the rows that come into view drawn from the image.
+        # The stages are as wide as the walls are heading for, so they are only made again when the
+        # walls widen, and the column is cut out of them as the walls ease open.
+        self.stages = None
+        self.left = None
+        self.rows = None
+        self.past_top = None
 
     def update(self, dt, events):
         pass
 
+    def layer_offsets(self):
+        """ Returns how far layers 3, 2.5, 2 and 1 have scrolled down. """
+        height = self.game.y_offset
+        return (height/18/self.slowness - 4500,
+                height/9/self.slowness - 150,
+                height/7/self.slowness - 200,
+                height/5/self.slowness)
+
+    def allocate(self):
+        """ Makes the stages for the width the walls are widening to, or have. """
+        walls = self.game.walls
+        width = int(max(walls.target_width, walls.width))
+        self.left = c.MIDDLE_X - width//2 - self.padding
+        size = (width + self.padding*2, c.WINDOW_HEIGHT)
+        self.stages = [pygame.Surface(size).convert() for _ in range(4)]
+        self.rows = None
+
+    def draw_base(self, top, bottom):
+        """ Draws rows top to bottom of layer 3 into the first stage. """
+        base = self.stages[0]
+        strip = pygame.Rect(0, top, base.get_width(), bottom - top)
+        base.fill(self.navy if self.past_top else c.BLACK, strip)
+        base.blit(self.layer_3, strip, strip.move(self.left, self.rows[0]))
+
     def draw(self, surface):
-        offset = -self.game.y_offset % 200
+        x = c.MIDDLE_X - self.game.walls.width//2 - self.padding
+        w = self.game.walls.width + self.padding * 2
+        offsets = self.layer_offsets()
+        # Rects round the same way blit does, so they change exactly when the drawn pixels do
+        column = pygame.Rect(x, 0, w, c.WINDOW_HEIGHT)
+        rows = [pygame.Rect(0, -y, 0, 0).y for y in offsets]
 
-        height = self.game.y_offset
-        slowness = 10
-
-        padding = 20
-        x = c.MIDDLE_X - self.game.walls.width//2 - padding
-        y = height/18/slowness - 4500
-        w = self.game.walls.width + padding * 2
-        navy = (19, 29, 71)
-        if y > 0:
-            surface.fill(navy)
-        h = c.WINDOW_HEIGHT
-        if h > 0:
-            surface.blit(self.layer_3, (x, 0), (x, -y, w, h))
-
-        padding = 20
-        x = c.MIDDLE_X - self.game.walls.width//2 - padding
-        y = height/9/slowness - 150
-        w = self.game.walls.width + padding * 2
-        h = c.WINDOW_HEIGHT
-        if h > 0:
-            surface.blit(self.layer_2_5, (x, 0), (x, -y, w, h))
-
-        padding = 20
-        x = c.MIDDLE_X - self.game.walls.width//2 - padding
-        y = height / 7 / slowness - 200
-        w = self.game.walls.width + padding * 2
-        h = c.WINDOW_HEIGHT
-        if h > 0:
-            surface.blit(self.layer_2, (x, 0), (x, -y, w, h))
-
-        padding = 20
-        x = c.MIDDLE_X - self.game.walls.width//2 - padding
-        y = height/5/slowness
-        w = self.game.walls.width + padding * 2
-        h = c.WINDOW_HEIGHT
-        if h > 0:
-            surface.blit(self.layer_1, (x, 0), (x, -y, w, h))
\ No newline at end of file
+        # Layer 3 runs out near the top of the world, and the sky behind it is navy
+        past_top = offsets[0] > 0
+        if past_top:
+            surface.fill(self.navy)
+
+        if self.stages is None or column.x < self.left or column.right > self.left + self.stages[0].get_width():
+            self.allocate()
+        height = c.WINDOW_HEIGHT
+        if self.rows is None or past_top != self.past_top or abs(rows[0] - self.rows[0]) >= height:
+            self.rows, self.past_top = rows, past_top
+            self.draw_base(0, height)
+            changed = 1
+        else:
+            scroll = rows[0] - self.rows[0]
+            self.rows = [rows[0]] + self.rows[1:]
+            if scroll > 0:
+                self.stages[0].scroll(0, -scroll)
+                self.draw_base(height - scroll, height)
+            elif scroll < 0:
+                self.stages[0].scroll(0, -scroll)
+                self.draw_base(0, -scroll)
+            changed = 1 if scroll else next((i for i in range(1, 4) if rows[i] != self.rows[i]), 4)
+            self.rows = rows
+
+        layers = (self.layer_2_5, self.layer_2, self.layer_1)
+        for i in range(changed, 4):
+            stage = self.stages[i]
+            stage.blit(self.stages[i - 1], (0, 0))
+            stage.blit(layers[i - 1], (0, 0), (self.left, rows[i], stage.get_width(), height))
+
+        surface.blit(self.stages[3], (column.x, 0), column.move(-self.left, 0))
@@ -0,0 +1,307 @@
+""" Headless benchmarks of the game's per-frame hot paths.
+
+    Runs against the SDL dummy video and audio drivers, so no window or sound device is needed.
+    Results are printed and can be written as JSON for comparison with another commit:
+
+        python benchmark.py --output before.json
+        python benchmark.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+
+from simulation import Simulation, init_headless
+
+init_headless()
+
+import pygame
+
+import constants as c
+
+
+benchmarks = []
+
+
+def benchmark(name, repeat=200):
+    """ Registers a benchmark. The decorated function does any setup and returns the callable to time. """
+    def register(setup):
+        benchmarks.append((name, setup, repeat))
+        return setup
+    return register
+
+
+def simulation(enemies=10, seed=0):
+    sim = Simulation()
+    sim.reset(seed)
+    sim.update_enemies(0, [], n=enemies)
+    return sim
+
+
+def time_calls(function, repeat):
+    """ Returns the duration of each of repeat calls of function, in seconds. """
+    function()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+for count in (10, 100, 1000):
+    @benchmark(f"player_update[{count}]")
+    def player_update(count=count):
+        sim = simulation(count)
+        player = sim.player
+
+        def run():
+            player.x, player.y = c.MIDDLE_X, sim.enemies[len(sim.enemies)//2].y
+            player.velocity = (0, 0)
+            player.update(c.SIM_DT, [])
+        return run
+
+    @benchmark(f"slice_enemies_touched[{count}]")
+    def slice_enemies_touched(count=count):
+        sim = simulation(count)
+        sim.aiming = True
+        sim.player.y = sim.enemies[len(sim.enemies)//2].y
+        sim.y_offset = sim.player.y - c.WINDOW_HEIGHT*0.7
+        sim.mouse_screen_position = sim.game_position_to_screen_position((c.MIDDLE_X, sim.player.y + 200))
+        # The same band of heights the slice queries, which must hold lanterns for the test to be timed
+        length = sim.player.cut_distance
+        reach = sim.enemies.max_radius
+        low = sim.player.y - length - reach
+        high = min(sim.player.y + length + reach, sim.y_offset + 2*c.WINDOW_HEIGHT)
+        assert sim.enemies.window(low, high), "no lanterns in reach of the cut"
+        return sim.slice.enemies_touched
+
+
+@benchmark("enemy_update[10]")
+def enemy_update():
+    sim = simulation()
+    enemies = list(sim.enemies)
+
+    def run():
+        for enemy in enemies:
+            enemy.update(c.SIM_DT, [])
+    return run
+
+
+@benchmark("generate_glow", repeat=2000)
+def generate_glow():
+    enemy = simulation().enemies[1]
+    phase = [0]
+
+    def run():
+        phase[0] += 1
+        enemy.generate_glow(1.7 + 0.07*((phase[0] % 10)/5 - 1))
+    return run
+
+
+@benchmark("particles_after_burst", repeat=50)
+def particles_after_burst():
+    """ Ten lanterns destroyed at once, then one second of particle updates. """
+    def run():
+        sim = simulation(20)
+        sim.player.velocity = (300, 1500)
+        for enemy in list(sim.enemies)[1:11]:
+            enemy.destroy()
+        for _ in range(c.MAX_FPS):
+            for particle in sim.particles[::-1]:
+                particle.update(c.SIM_DT, [])
+            sim.chunks.update(c.SIM_DT, [])
+            for particle in sim.text_particles[::-1]:
+                particle.update(c.SIM_DT, [])
+    return run
+
+
+def screen():
+    return pygame.display.set_mode(c.WINDOW_SIZE)
+
+
+@benchmark("background_draw")
+def background_draw():
+    from background import Background
+    sim = simulation()
+    surface = screen()
+    background = Background(sim)
+
+    def run():
+        sim.y_offset += 7
+        background.draw(surface)
+    return run
+
+
+@benchmark("walls_draw")
+def walls_draw():
+    sim = simulation()
+    surface = screen()
+
+    def run():
+        sim.y_offset += 7
+        sim.walls.draw(surface)
+    return run
+
+
+@benchmark("button_draw", repeat=1000)
+def button_draw():
+    from button import Button
+    surface = screen()
+    button = Button((c.MIDDLE_X, c.MIDDLE_Y), "High scores")
+
+    def run():
+        button.update(c.SIM_DT, [])
+        button.draw(surface)
+    return run
+
+
+@benchmark("title_frame", repeat=1000)
+def title_frame():
+    """ Title screen frame drawn through the compositor, so only the buttons are pushed. """
+    import assets
+    from button import Button
+    from compositor import Compositor
+    compositor = Compositor(screen())
+    buttons = [Button((c.MIDDLE_X, c.MIDDLE_Y + 100), "Play", (1, 1)),
+               Button((c.MIDDLE_X, c.MIDDLE_Y + 155), "High scores", (1, 1))]
+    compositor.set_background(assets.image("title.png"))
+
+    def run():
+        compositor.restore()
+        for button in buttons:
+            button.update(c.SIM_DT, [])
+            compositor.add(button.draw(compositor.surface))
+        compositor.present()
+    return run
+
+
+@benchmark("game_frame", repeat=300)
+def game_frame():
+    """ Full update, draw and flip of a scripted run: aim at the next lantern up, then release. """
+    from game import Game
+    game = Game()
+    game.reset()
+    frame = [0]
+
+    def run():
+        frame[0] += 1
+        events = []
+        if frame[0] % 40 == 10:
+            events.append(pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=1))
+        elif frame[0] % 40 == 30:
+            events.append(pygame.event.Event(pygame.MOUSEBUTTONUP, button=1))
+        above = game.enemies.window(game.player.y + 50)
+        target = above[0] if above else game.enemies[-1]
+        x, y = game.game_position_to_screen_position((target.x, target.y))
+        game.game_frame(c.SIM_DT, events, (int(x), int(y)))
+        if game.queue_reset:
+            game.reset()
+    return run
+
+
+def wire_messages():
+    """ Fields of the messages the game and server exchange, at realistic sizes. """
+    from replay import Replay
+    from scoreboard import Scoreboard
+    board = Scoreboard()
+    for i in range(300):
+        board.push(f"P{i % 1000:03}", i * 37 % 5000)
+    replay = Replay(1234, [(c.SIM_DT, (), (c.MIDDLE_X, c.MIDDLE_Y)) for _ in range(60 * c.MAX_FPS)])
+    return {"push": {"type": "push", "score": 4321, "name": "ALICE"},
+            "push_replay": {"type": "push", "score": 4321, "name": "ALICE", "replay": replay.to_bytes()},
+            "print": {"type": "print"},
+            "success": {"success": True},
+            "scores": {"scores": board.top()},
+            "scores_full": {"scores": board},
+            "sync": {"type": "sync", "since": board.index_count - 20, "top": 10, "name": "ALICE",
+                     "score": 4321},
+            "delta": {"version": board.index_count, "scores": board.changes(board.index_count - 20),
+                      "rank": 4}}
+
+
+for message in ("push", "push_replay", "print", "success", "scores", "scores_full", "sync", "delta"):
+    for codec in ("wire", "pickle"):
+        @benchmark(f"packet_encode[{message},{codec}]", repeat=1000)
+        def packet_encode(message=message, codec=codec):
+            import pickle
+            from sprocket import Packet
+            packet = Packet(**wire_messages()[message])
+            if codec == "wire":
+                run = lambda: packet.to_bytes()
+            else:
+                run = lambda: pickle.dumps(packet)
+            run.bytes = len(run())
+            return run
+
+        @benchmark(f"packet_decode[{message},{codec}]", repeat=1000)
+        def packet_decode(message=message, codec=codec):
+            import pickle
+            from sprocket import Packet
+            packet = Packet(**wire_messages()[message])
+            if codec == "wire":
+                data = packet.to_bytes()
+                return lambda: Packet.from_bytes(data)
+            data = pickle.dumps(packet)
+            return lambda: pickle.loads(data)
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(names=None):
+    results = {}
+    for name, setup, repeat in benchmarks:
+        if names and not any(part in name for part in names):
+            continue
+        function = setup()
+        durations = time_calls(function, repeat)
+        results[name] = {"median_us": statistics.median(durations) * 1e6,
+                         "mean_us": statistics.mean(durations) * 1e6,
+                         "min_us": min(durations) * 1e6,
+                         "repeat": repeat}
+        line = f"{name:<36} {results[name]['median_us']:12.1f} us median"
+        # Benchmarks that produce data can report its size through a bytes attribute
+        if hasattr(function, "bytes"):
+            results[name]["bytes"] = function.bytes
+            line += f" {function.bytes:10} bytes"
+        print(line)
+    return results
+
+
+def compare(results, baseline):
+    print(f"\n{'benchmark':<36} {'before':>12} {'after':>12} {'ratio':>8}")
+    for name in results:
+        if name not in baseline:
+            continue
+        before = baseline[name]["median_us"]
+        after = results[name]["median_us"]
+        print(f"{name:<36} {before:12.1f} {after:12.1f} {after/before:8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the game's hot paths headlessly.")
+    parser.add_argument("names", nargs="*", help="only run benchmarks whose name contains one of these")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.names)
+    report = {"commit": commit(),
+              "python": platform.python_version(),
+              "pygame": pygame.version.ver,
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
@@ -1,6 +1,5 @@
 import pygame
-import os
-import constants as c
+import fonts
 
 
 class Button:
@@ -20,7 +19,6 @@ class Button:
         self.target_scale = 1.0
         self.font_size = 40
         self.target_font_size = 40
-        self.font = pygame.font.Font(os.path.join(c.ASSETS_PATH, "no_continue.ttf"), self.font_size)
 
     def hovered(self):
         if self.disabled:
@@ -71,12 +69,12 @@ class Button:
         return (shade, shade, shade)
 
     def draw(self, surface):
+        """ Returns the rectangle drawn to, or None if the button is hidden. """
         if not self.visible:
-            return
-        self.font = pygame.font.Font(os.path.join(c.ASSETS_PATH, "no_continue.ttf"), int(self.font_size * self.true_scale))
-        surf = self.font.render(self.text, 0, self.color())
+            return None
+        surf = fonts.render("no_continue.ttf", int(self.font_size * self.true_scale), self.text, 0, self.color())
         self.width = surf.get_width()
         self.height = surf.get_height()
         x = self.x - surf.get_width()//2
         y = self.y - surf.get_height()//2
-        surface.blit(surf, (int(x), int(y)))
\ No newline at end of file
+        return surface.blit(surf, (int(x), int(y)))
\ No newline at end of file
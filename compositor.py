@@ -0,0 +1,58 @@
+import pygame
+
+
+__all__ = ["Compositor"]
+
+
+class Compositor:
+    """ Draws mostly static screens by pushing only the parts that changed to the display.
+
+        A screen is a cached static layer plus whatever is drawn over it each frame. Call restore at
+        the start of a frame to cover last frame's drawing with the static layer, add the rectangle
+        of everything drawn, and present at the end. present flips the whole display after
+        set_background or invalidate, and otherwise updates only this frame's and last frame's
+        rectangles.
+    """
+
+    def __init__(self, surface):
+        self.surface = surface
+        self.background = None
+        self.drawn = []
+        self.previous = []
+        self.full = True
+
+    def set_background(self, background):
+        """ Makes background the static layer and draws it. background is not copied. """
+        self.background = background
+        self.surface.blit(background, (0, 0))
+        self.drawn = []
+        self.previous = []
+        self.full = True
+
+    def invalidate(self):
+        """ Flips the whole display on the next present, for frames that draw across the screen. """
+        self.full = True
+
+    def restore(self):
+        for rect in self.previous:
+            self.surface.blit(self.background, rect, rect)
+
+    def add(self, rect):
+        if rect is not None:
+            self.drawn.append(rect)
+
+    def blit(self, source, position, area=None):
+        rect = self.surface.blit(source, position, area)
+        self.drawn.append(rect)
+        return rect
+
+    def present(self):
+        if self.full:
+            pygame.display.flip()
+            # Whatever covered the screen has to be restored everywhere next frame
+            self.drawn = [self.surface.get_rect()]
+        else:
+            pygame.display.update(self.previous + self.drawn)
+        self.previous = self.drawn
+        self.drawn = []
+        self.full = False
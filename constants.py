@@ -8,25 +8,101 @@ MIDDLE_Y = WINDOW_HEIGHT//2
 
 ASSETS_PATH = "assets"
 
+# Decoded assets are cached here to speed up later starts
+ASSET_CACHE_PATH = ".asset_cache"
+
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
 
 MAX_FPS = 65
 
+# Lantern sprites are drawn at angles rounded to this many degrees, so rotations can be shared
+LANTERN_ANGLE_STEP = 1
+
+# Fixed time step for headless simulation
+SIM_DT = 1/MAX_FPS
+
+# Inputs of the most recent run are saved here
+REPLAY_PATH = "last_run.replay"
+
+# Frame profiler, toggled in game with F3. Timings are written to PROFILE_PATH when it is turned off.
+PROFILE_HISTORY = 600
+PROFILE_OVERLAY_INTERVAL = 15
+PROFILE_PATH = "frame_profile.csv"
+
 SERVER_ADDR = "0.tcp.ngrok.io"
 SERVER_PORT = 14389
 SERVER_PORT_ADDR = "https://raw.githubusercontent.com/jeremycryan/ScoreSpace8/master/server_port.txt"
 
+# Server discovery. The port fetched from SERVER_PORT_ADDR is cached on disk for SERVER_PORT_TTL
+# seconds, and a failed fetch isn't retried for SERVER_PORT_RETRY seconds. A "host:port" or "port" in
+# the SERVER_OVERRIDE_ENV variable or the SERVER_OVERRIDE_PATH file skips the lookup.
+SERVER_PORT_CACHE_PATH = "server_port.cache"
+SERVER_OVERRIDE_PATH = "server_override.txt"
+SERVER_OVERRIDE_ENV = "LUMINARY_SERVER"
+SERVER_PORT_TTL = 600
+SERVER_PORT_RETRY = 30
+
 SCORE_RECEIVED = 1
 NO_CONNECT = 2
 TIMEOUT = 3
+REJECTED = 4
+BUSY = 5
 
 TIMEOUT_TIME = 2.0
 
+# Attach a replay to submitted scores so the server can verify them. A replay gets VERIFY_TIMEOUT
+# seconds plus one second per VERIFY_FRAME_RATE frames once a worker starts on it, well under what
+# a worker re-simulates, and may wait VERIFY_QUEUE_TIMEOUT seconds for one. The server turns
+# submissions away as busy past VERIFY_QUEUE_LIMIT waiting replays.
+SEND_REPLAYS = True
+VERIFY_TIMEOUT = 5.0
+VERIFY_FRAME_RATE = 3000
+VERIFY_QUEUE_TIMEOUT = 10.0
+VERIFY_QUEUE_LIMIT = 32
+MAX_REPLAY_FRAMES = 65 * 60 * 30
+
+# Seconds between server queue polls
+SERVER_TICK = 0.01
+
+# Server connections. Clients are dropped after CLIENT_IDLE_TIMEOUT seconds without a packet, or once
+# CLIENT_QUEUE_LIMIT packets to them are waiting to be written.
+SERVER_BACKLOG = 1024
+CLIENT_IDLE_TIMEOUT = 60.0
+CLIENT_QUEUE_LIMIT = 256
+MAX_PACKET_SIZE = 16 * 1024 * 1024
+
+# Server scoreboard storage. Pushes are fsynced in batches, and the board is snapshotted every so many
+SCORE_LOG_PATH = "scores.log"
+SCORE_SNAPSHOT_PATH = "scores.snapshot"
+SCORE_SYNC_INTERVAL = 0.5
+SCORE_SNAPSHOT_INTERVAL = 1000
+# Longest player name the server accepts
+MAX_NAME_LENGTH = 32
+
+# Server leaderboards. Every score counts towards the boards of each window for its mode and for
+# ALL_MODES. Boards are split between LEADERBOARD_WORKERS processes, which snapshot them every
+# LEADERBOARD_SNAPSHOT_INTERVAL submissions and rebuild them from their snapshot and the log of
+# submissions at LEADERBOARD_LOG_PATH when they start. Only the modes in GAME_MODES get
+# boards; the server turns away any other.
+GAME_MODES = ("classic",)
+DEFAULT_MODE = "classic"
+ALL_MODES = "any"
+BOARD_WINDOWS = ("all", "daily", "weekly")
+LEADERBOARD_WORKERS = 2
+LEADERBOARD_LOG_PATH = "leaderboards.log"
+LEADERBOARD_SNAPSHOT_PATH = "leaderboards.snapshot"
+LEADERBOARD_SNAPSHOT_INTERVAL = 10000
+
 TITLE = 0
 GAME_PHASE = 1
 NAME_PHASE = 2
 
+# Player inputs fed to the simulation
+PRESS = 0
+RELEASE = 1
+GIVE_UP = 2
+
 # Filter these out of possible names
 PROFANITY = ["anal",
 "anus",
@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+import time
+import urllib.request
+
+import constants as c
+
+
+__all__ = ["ServerDiscovery", "parse_address"]
+
+
+def parse_address(text, default_host=c.SERVER_ADDR):
+    """ Returns the (host, port) of a "host:port" or "port" string. Raises ValueError if it's neither. """
+    host, _, port = text.strip().rpartition(":")
+    port = int(port)
+    if not 0 < port < 65536:
+        raise ValueError(f"{port} is not a valid port.")
+    return host or default_host, port
+
+
+class ServerDiscovery:
+    """ Finds the score server's address without keeping the caller waiting on the network.
+
+        The port is looked up at SERVER_PORT_ADDR on a background thread and cached on disk, so a
+        fresh lookup is only needed every SERVER_PORT_TTL seconds, even across restarts. A failed
+        lookup is cached too: for SERVER_PORT_RETRY seconds afterwards the game counts as offline
+        and requests fail straight away, rather than each waiting on the lookup again. An address in
+        the SERVER_OVERRIDE_ENV variable or the SERVER_OVERRIDE_PATH file replaces the lookup.
+    """
+
+    def __init__(self, url=c.SERVER_PORT_ADDR, cache_path=c.SERVER_PORT_CACHE_PATH,
+                 override_path=c.SERVER_OVERRIDE_PATH, ttl=c.SERVER_PORT_TTL, retry=c.SERVER_PORT_RETRY):
+        self.url = url
+        self.cache_path = cache_path
+        self.override_path = override_path
+        self.ttl = ttl
+        self.retry = retry
+        self.port = None
+        self.fetched = 0
+        self.failed = 0
+        self.mutex = threading.Lock()
+        self.lookup = None
+        self.read_cache()
+
+    def override(self):
+        """ Returns the address set in the environment or override file, or None if there isn't one. """
+        text = os.environ.get(c.SERVER_OVERRIDE_ENV)
+        if text is None:
+            try:
+                with open(self.override_path) as f:
+                    text = f.read()
+            except OSError:
+                return None
+        try:
+            return parse_address(text)
+        except ValueError:
+            return None
+
+    def read_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+            port, fetched, failed = cache["port"], float(cache["fetched"]), float(cache["failed"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        if port is None or type(port) is int:
+            self.port, self.fetched, self.failed = port, fetched, failed
+
+    def write_cache(self):
+        """ Writes the cache atomically. It's only an optimization, so failures are ignored. """
+        try:
+            with open(self.cache_path + ".tmp", "w") as f:
+                json.dump({"port": self.port, "fetched": self.fetched, "failed": self.failed}, f)
+            os.replace(self.cache_path + ".tmp", self.cache_path)
+        except OSError:
+            pass
+
+    def stale(self, now=None):
+        now = time.time() if now is None else now
+        if self.failed > self.fetched:
+            return now - self.failed > self.retry
+        return now - self.fetched > self.ttl
+
+    def fetch(self):
+        try:
+            with urllib.request.urlopen(self.url, timeout=c.TIMEOUT_TIME) as file:
+                port = int(file.readline())
+        except (OSError, ValueError):
+            port = None
+        with self.mutex:
+            if port is None:
+                # Keep the last port that worked, in case only the lookup is down
+                self.failed = time.time()
+            else:
+                self.port, self.fetched = port, time.time()
+            self.lookup = None
+        self.write_cache()
+
+    def invalidate(self):
+        """ Marks the cached port as stale, say because the server refused a connection on it. """
+        with self.mutex:
+            self.fetched = min(self.fetched, time.time() - self.ttl - 1)
+
+    def refresh(self):
+        """ Starts a lookup on a background thread if the cached port is stale. Returns the thread
+            of the lookup in progress, or None if there isn't one.
+        """
+        with self.mutex:
+            if self.lookup is None and self.stale():
+                self.lookup = threading.Thread(target=self.fetch, daemon=True)
+                self.lookup.start()
+            return self.lookup
+
+    def address(self):
+        """ Returns the server's (host, port) as currently known, or None, without waiting. A stale
+            port is still returned, while a lookup to replace it runs in the background.
+        """
+        override = self.override()
+        if override is not None:
+            return override
+        self.refresh()
+        if self.port is None:
+            return None
+        return c.SERVER_ADDR, self.port
+
+    def resolve(self, timeout=c.TIMEOUT_TIME):
+        """ Returns the server's (host, port), waiting up to timeout seconds for a lookup if no port
+            is known yet. Returns None if the port is still unknown. Meant for background threads.
+        """
+        override = self.override()
+        if override is not None:
+            return override
+        lookup = self.refresh()
+        if self.port is None and lookup is not None:
+            lookup.join(timeout)
+        return self.address()
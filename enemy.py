@@ -1,48 +1,73 @@
 import constants as c
 import pygame
 import math
-from particle import Particle, Chunk, Fadeout
-import os
-import random
+from particle import Particle, Fadeout
+import assets
 import time
 
 
-lantern_surf = pygame.image.load(os.path.join(c.ASSETS_PATH, "lantern.png"))
-lantern_touched_surf = pygame.image.load(os.path.join(c.ASSETS_PATH, "lantern_touched.png"))
-big_lantern_surf = pygame.image.load(os.path.join(c.ASSETS_PATH, "big_lantern.png"))
-big_lantern_touched_surf = pygame.image.load(os.path.join(c.ASSETS_PATH, "big_lantern_touched.png"))
-perfect_surf = pygame.image.load(os.path.join(c.ASSETS_PATH, "perfect.png"))
-perfect_surf_large = pygame.transform.scale(perfect_surf, (perfect_surf.get_width()*2, perfect_surf.get_height()*2))
-good_surf = pygame.image.load(os.path.join(c.ASSETS_PATH, "good.png"))
-okay_surf = pygame.image.load(os.path.join(c.ASSETS_PATH, "okay.png"))
-nope_surf = pygame.image.load(os.path.join(c.ASSETS_PATH, "nope.png"))
+# Glow surfaces by pixel radius, shared by every lantern. The pulse only spans a handful of
+# integer radii per lantern size, so after the first few frames no glow is ever reallocated.
+glow_cache = {}
+
+
+def get_glow(glow_radius):
+    if glow_radius not in glow_cache:
+        glow = pygame.Surface((glow_radius*2, glow_radius*2))
+        pygame.draw.circle(glow, c.WHITE, (glow_radius, glow_radius), glow_radius)
+        glow.set_alpha(20)
+        glow.set_colorkey(c.BLACK)
+        glow_cache[glow_radius] = glow
+    return glow_cache[glow_radius]
+
+
+# Rotated lantern sprites by (image name, angle step). Angles are rounded to LANTERN_ANGLE_STEP so
+# that spawning a lantern only looks up surfaces baked at load.
+rotation_cache = {}
+
+
+def get_rotated(name, angle):
+    step = round(angle / c.LANTERN_ANGLE_STEP)
+    key = (name, step)
+    if key not in rotation_cache:
+        rotated = pygame.transform.rotate(assets.image(name), step * c.LANTERN_ANGLE_STEP)
+        if pygame.display.get_surface() is None:
+            return rotated
+        rotation_cache[key] = rotated
+    return rotation_cache[key]
+
+
+def prebake_rotations():
+    """ Fills the rotation cache for every angle a lantern can spawn at. """
+    for enemy_type in (Enemy, BigEnemy, SmallEnemy):
+        low, high = (round(angle / c.LANTERN_ANGLE_STEP) for angle in enemy_type.angle_range)
+        for step in range(low, high + 1):
+            for name in enemy_type.images:
+                get_rotated(name, step * c.LANTERN_ANGLE_STEP)
 
 
 class Enemy:
+    images = ("lantern.png", "lantern_touched.png")
+    angle_range = (15, 75)
 
     def __init__(self, game, radius = 30, x=c.WINDOW_WIDTH//2, y=c.WINDOW_HEIGHT//2):
         self.game = game
         self.radius = radius
         self.x = x
         self.y = y
-        self.angle = random.random() * 60 + 15
-        self.surf = lantern_surf
-        self.draw_surf = pygame.transform.rotate(self.surf, self.angle)
-        self.touched_surf = lantern_touched_surf
-        self.touched_surf = pygame.transform.rotate(self.touched_surf, self.angle)
+        self.angle = self.game.random.random() * 60 + 15
+        self.surf = assets.image(self.images[0])
+        self.draw_surf = get_rotated(self.images[0], self.angle)
+        self.touched_surf = get_rotated(self.images[1], self.angle)
         # self.draw_surf.set_colorkey(c.BLACK)
         # self.touched_surf.set_colorkey(c.BLACK)
         self.touched = False
         self.launch_factor=1.0
         self.glow = self.generate_glow()
-        self.age = random.random()
+        self.age = self.game.random.random()
 
     def generate_glow(self, radius=1.7):
-        glow_radius = int(radius * self.radius)
-        self.glow = pygame.Surface((glow_radius*2, glow_radius*2))
-        pygame.draw.circle(self.glow, c.WHITE, (glow_radius, glow_radius), glow_radius)
-        self.glow.set_alpha(20)
-        self.glow.set_colorkey(c.BLACK)
+        self.glow = get_glow(int(radius * self.radius))
         return self.glow
 
     def update(self, dt, events):
@@ -104,25 +129,26 @@ class Enemy:
                                 angle=angle)
         self.game.particles.append(bottom_half)
 
-        self.game.particles.append(Fadeout(self.game, self.glow, (self.x, self.y)))
+        # The glow is shared with other lanterns, so fade out a copy of it
+        glow = self.glow.copy()
+        self.game.particles.append(Fadeout(self.game, glow, (self.x, self.y)))
 
-        for i in range(30):
-            self.game.particles.append(Chunk(self.game, (self.x, self.y)))
+        self.game.chunks.spawn((self.x, self.y), 30)
 
         if abs(cut_prop - 0.5) < 0.02:
-            self.glow.set_alpha(100)
-            surf = perfect_surf.copy().convert()
-            surf2 = perfect_surf_large.copy().convert()
+            glow.set_alpha(100)
+            surf = assets.image("perfect.png").copy().convert()
+            surf2 = assets.image("perfect.png", scale=2).copy().convert()
             surf2.set_colorkey((255, 0, 255))
             surf2.set_alpha(90)
             self.game.text_particles.append(Fadeout(self.game, surf2, (self.x, self.y), rate=200))
             self.game.flare_up(60)
             self.game.tear_sound()
         elif abs(cut_prop - 0.5) < 0.25:
-            surf = good_surf.copy().convert()
+            surf = assets.image("good.png").copy().convert()
             self.game.bad_tear_sound()
         else:
-            surf = okay_surf.copy().convert()
+            surf = assets.image("okay.png").copy().convert()
             self.game.bad_tear_sound()
         surf.set_colorkey((255, 0, 255))
         surf.set_alpha(255)
@@ -130,16 +156,18 @@ class Enemy:
 
 
 class BigEnemy(Enemy):
+    images = ("big_lantern.png", "big_lantern_touched.png")
+    angle_range = (-30, 30)
+
     def __init__(self, game, x=c.WINDOW_WIDTH//2, y=c.WINDOW_HEIGHT//2):
         self.game = game
         self.radius = 40
         self.x = x
         self.y = y
-        self.angle = random.random() * 60 - 30
-        self.surf = big_lantern_surf
-        self.draw_surf = pygame.transform.rotate(self.surf, self.angle)
-        self.touched_surf = big_lantern_touched_surf
-        self.touched_surf = pygame.transform.rotate(self.touched_surf, self.angle)
+        self.angle = self.game.random.random() * 60 - 30
+        self.surf = assets.image(self.images[0])
+        self.draw_surf = get_rotated(self.images[0], self.angle)
+        self.touched_surf = get_rotated(self.images[1], self.angle)
         self.touched = False
         self.launch_factor = 1.3
         self.age = 0
@@ -159,7 +187,7 @@ class TutorialEnemy(BigEnemy):
         else:
             self.game.nope.play()
             self.game.shake_effect(15)
-            surf = nope_surf.copy().convert()
+            surf = assets.image("nope.png").copy().convert()
             surf.set_colorkey((255, 0, 255))
             surf.set_alpha(255)
             self.game.text_particles.append(Fadeout(self.game, surf, (self.x, self.y), rate=400))
@@ -167,16 +195,17 @@ class TutorialEnemy(BigEnemy):
 
 
 class SmallEnemy(Enemy):
+    images = ("small_lantern.png", "small_lantern_touched.png")
+
     def __init__(self, game, x=c.WINDOW_WIDTH//2, y=c.WINDOW_HEIGHT//2):
         self.game = game
         self.radius = 35
         self.x = x
         self.y = y
-        self.angle = random.random() * 60 + 15
-        self.surf = pygame.image.load(os.path.join(c.ASSETS_PATH, "small_lantern.png"))
-        self.draw_surf = pygame.transform.rotate(self.surf, self.angle)
-        self.touched_surf = pygame.image.load(os.path.join(c.ASSETS_PATH, "small_lantern_touched.png"))
-        self.touched_surf = pygame.transform.rotate(self.touched_surf, self.angle)
+        self.angle = self.game.random.random() * 60 + 15
+        self.surf = assets.image(self.images[0])
+        self.draw_surf = get_rotated(self.images[0], self.angle)
+        self.touched_surf = get_rotated(self.images[1], self.angle)
         self.touched = False
         self.launch_factor = 1.15
         self.age = 0
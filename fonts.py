@@ -0,0 +1,61 @@
+import os
+from collections import OrderedDict
+
+import pygame
+
+import constants as c
+
+
+__all__ = ["get_font", "render", "text_cache"]
+
+
+# Fonts by (file name, size), shared by the whole process
+fonts = {}
+
+
+def get_font(name, size):
+    """ Returns the font from the assets folder at the given size, opening it only the first time. """
+    key = (name, size)
+    if key not in fonts:
+        fonts[key] = pygame.font.Font(os.path.join(c.ASSETS_PATH, name), size)
+    return fonts[key]
+
+
+class TextCache:
+    """ Least recently used cache of rendered text surfaces.
+
+        Surfaces are shared between callers, so anyone changing a surface's alpha or colorkey
+        should set it again on every draw.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font_name, size, text, antialias, color):
+        key = (font_name, size, text, antialias, color)
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surf
+        self.misses += 1
+        surf = get_font(font_name, size).render(text, antialias, color)
+        self.surfaces[key] = surf
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return surf
+
+    def clear(self):
+        self.surfaces.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+text_cache = TextCache()
+
+
+def render(font_name, size, text, antialias, color):
+    return text_cache.render(font_name, size, text, antialias, color)
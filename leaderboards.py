@@ -0,0 +1,588 @@
+import datetime
+import itertools
+import multiprocessing
+import os
+import queue
+import signal
+import struct
+import time
+import zlib
+from bisect import bisect_left
+
+from scoreboard import Score, Scoreboard
+from scorestore import decode_name, encode_name
+import constants as c
+
+
+__all__ = ["LeaderboardService", "Board", "RankedList", "board_key", "board_keys"]
+
+
+class RankedList:
+    """ Sorted list of keys, split into blocks of up to 2*load keys.
+
+        Finding a key bisects the blocks' last keys and then one block, so inserts and removals only
+        shift the keys of a single small block rather than the whole list. A Fenwick tree over the
+        blocks' lengths gives the number of keys before a block in O(log blocks), and is only
+        rebuilt when blocks are split or removed.
+    """
+
+    load = 512
+
+    def __init__(self):
+        self.blocks = []
+        self.maxes = []
+        self.tree = [0]
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.blocks)
+
+    def rebuild(self):
+        tree = [0] + [len(block) for block in self.blocks]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def resize(self, i, change):
+        """ Records that block i grew by change keys. """
+        i += 1
+        while i < len(self.tree):
+            self.tree[i] += change
+            i += i & -i
+
+    def locate(self, key):
+        """ Returns the block that key belongs in and its position there. """
+        i = min(bisect_left(self.maxes, key), len(self.blocks) - 1)
+        return i, bisect_left(self.blocks[i], key)
+
+    def rank(self, i, position):
+        while i > 0:
+            position += self.tree[i]
+            i -= i & -i
+        return position
+
+    def add(self, key):
+        """ Inserts key. Returns its rank, counting from 0. """
+        self.size += 1
+        if not self.blocks:
+            self.blocks.append([key])
+            self.maxes.append(key)
+            self.rebuild()
+            return 0
+        i, position = self.locate(key)
+        block = self.blocks[i]
+        block.insert(position, key)
+        self.maxes[i] = block[-1]
+        self.resize(i, 1)
+        rank = self.rank(i, position)
+        if len(block) > 2*self.load:
+            self.blocks[i:i + 1] = [block[:self.load], block[self.load:]]
+            self.maxes[i:i + 1] = [block[self.load - 1], block[-1]]
+            self.rebuild()
+        return rank
+
+    def remove(self, key):
+        """ Removes key, which must be in the list. """
+        i, position = self.locate(key)
+        block = self.blocks[i]
+        del block[position]
+        self.size -= 1
+        if block:
+            self.maxes[i] = block[-1]
+            self.resize(i, -1)
+        else:
+            del self.blocks[i]
+            del self.maxes[i]
+            self.rebuild()
+
+    def restore(self, keys):
+        """ Replaces the contents with keys, which must be sorted. """
+        self.blocks = [keys[i:i + self.load] for i in range(0, len(keys), self.load)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.size = len(keys)
+        self.rebuild()
+
+    def index(self, key):
+        """ Returns the rank of key, which must be in the list. """
+        return self.rank(*self.locate(key))
+
+    def top(self, rows):
+        return list(itertools.islice(self, rows))
+
+
+class Board:
+    """ Leaderboard holding each player's best score, with no limit on its length.
+
+        Expires is the time at which the board's period ends, or None for boards that never do.
+    """
+
+    def __init__(self, expires=None):
+        self.expires = expires
+        self.ranked = RankedList()
+        self.best = {}
+        self.index_count = 0
+
+    def submit(self, name, score):
+        """ Records a score. Returns the rank of the player's best score, counting from 0. """
+        index = self.index_count
+        self.index_count += 1
+        old = self.best.get(name)
+        if old is not None:
+            if old[0] <= -score:
+                # Not an improvement; the earlier score keeps its place
+                return self.ranked.index(old)
+            self.ranked.remove(old)
+        key = (-score, -index, name)
+        self.best[name] = key
+        return self.ranked.add(key)
+
+    def restore(self, rows, index_count):
+        """ Replaces the board's scores with rows of (name, score, index), as top returns them. """
+        keys = sorted((-score, -index, name) for name, score, index in rows)
+        self.best = {key[2]: key for key in keys}
+        self.ranked.restore(keys)
+        self.index_count = index_count
+
+    def rank_of(self, name):
+        """ Returns the rank of the player's best score, or None if they have no score here. """
+        key = self.best.get(name)
+        return None if key is None else self.ranked.index(key)
+
+    def top(self, rows=None):
+        """ Returns the best rows scores, or all of them, as (name, score, index) tuples, best first. """
+        keys = self.ranked if rows is None else self.ranked.top(rows)
+        return [(name, -score, -index) for score, index, name in keys]
+
+
+def period(window, when):
+    """ Returns the name, start and end time of the period of a time windowed board that contains
+        when.
+    """
+    day = datetime.datetime.fromtimestamp(when, datetime.timezone.utc).date()
+    if window == "daily":
+        start = day
+        end = day + datetime.timedelta(days=1)
+        name = day.isoformat()
+    elif window == "weekly":
+        start = day - datetime.timedelta(days=day.weekday())
+        end = start + datetime.timedelta(weeks=1)
+        year, week, _ = day.isocalendar()
+        name = f"{year}-W{week:02}"
+    else:
+        raise ValueError(f"Unknown board window {window!r}.")
+    start = datetime.datetime.combine(start, datetime.time(), datetime.timezone.utc)
+    end = datetime.datetime.combine(end, datetime.time(), datetime.timezone.utc)
+    return name, start.timestamp(), end.timestamp()
+
+
+def board_key(window, mode, when=None):
+    """ Returns the key of a board and the time it expires, or None for the all time boards. Keys
+        look like "classic/all", "any/daily/2026-10-18" and "classic/weekly/2026-W42".
+    """
+    if window == "all":
+        return f"{mode}/all", None
+    when = time.time() if when is None else when
+    name, _, expires = period(window, when)
+    return f"{mode}/{window}/{name}", expires
+
+
+def board_keys(mode, when=None):
+    """ Returns the keys and expiry times of every board a score in this mode counts towards. """
+    modes = [mode] if mode == c.ALL_MODES else [mode, c.ALL_MODES]
+    return [board_key(window, board_mode, when) for board_mode in modes for window in c.BOARD_WINDOWS]
+
+
+def shard_of(key, shards):
+    # crc32 rather than hash, which differs between processes
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+
+def run_shard(inbox, results, shard, shards, log_path, snapshot_path, log_length):
+    """ Worker process holding the boards of one shard. Rebuilds them from the shard's snapshot
+        and the first log_length bytes of the log, then answers requests from inbox until it gets
+        None. Boards are dropped once their period is over.
+    """
+    # A parent that set up pygame passes on SDL's SIGTERM handler, which would keep terminate from working
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    state = Shard(shard, shards, log_path, snapshot_path)
+    try:
+        state.load(log_length)
+    except (OSError, ValueError, struct.error) as e:
+        # Starting empty beats dying, which would only have the worker restarted into the same error
+        print(f"Leaderboard worker {shard} couldn't rebuild its boards: {e!r}")
+        state.boards = {}
+    while True:
+        request = inbox.get()
+        if request is None:
+            return
+        now = time.time()
+        state.expire(now)
+        kind, token, arguments = request
+        try:
+            results.put((token, state.handle(now, kind, arguments)))
+        except Exception as e:
+            # A bad request fails on its own; the shard keeps serving its boards
+            print(f"Leaderboard {kind} request failed: {e!r}")
+            results.put((token, None))
+
+
+class Shard:
+    """ The boards of one shard, as kept by its worker.
+
+        On request the worker snapshots its boards along with the length of the log they cover, so
+        starting up only replays the log's later records. Records of periods that are already over
+        only count towards the all time boards, and are replayed without working out their periods.
+    """
+
+    snapshot_magic = b"LMLS"
+    version = 1
+    # magic, version, shard, shard count, log length covered, board count
+    snapshot_header = struct.Struct("!4sBIIQI")
+    board_header = struct.Struct("!dQIH")   # expiry time or 0, index count, row count, key length
+    snapshot_row = struct.Struct("!qqH")    # index, score, name length
+
+    def __init__(self, shard, shards, log_path, snapshot_path):
+        self.shard = shard
+        self.shards = shards
+        self.log_path = log_path
+        self.snapshot_path = f"{snapshot_path}.{shard}"
+        self.boards = {}
+
+    def expire(self, now):
+        for key in [key for key, board in self.boards.items() if board.expires is not None and board.expires <= now]:
+            del self.boards[key]
+
+    def handle(self, now, kind, arguments):
+        """ Returns the result of one request. """
+        if kind == "submit":
+            name, score, keys = arguments
+            return self.submit(now, name, score, keys)
+        if kind == "query":
+            key, rows, name = arguments
+            board = self.boards.get(key)
+            if board is None:
+                return [], None
+            return board.top(rows), board.rank_of(name)
+        if kind == "snapshot":
+            self.write_snapshot(arguments)
+            return True
+        raise ValueError(f"Unknown leaderboard request {kind!r}.")
+
+    def submit(self, now, name, score, keys):
+        """ Records a score on the boards with the given keys that haven't expired. Returns the
+            player's rank on each, by key.
+        """
+        ranks = {}
+        for key, expires in keys:
+            if expires is not None and expires <= now:
+                continue
+            if key not in self.boards:
+                self.boards[key] = Board(expires)
+            ranks[key] = self.boards[key].submit(name, score)
+        return ranks
+
+    def load(self, log_length):
+        now = time.time()
+        offset = LeaderboardService.log_header.size
+        snapshot = self.read_snapshot()
+        if snapshot is not None and snapshot[1] <= log_length:
+            self.boards, offset = snapshot
+            self.expire(now)
+        records, _ = LeaderboardService.read_log(self.log_path, offset, log_length)
+
+        # Windowed boards running now all started by the start of the oldest current period
+        running_since = min(period(window, now)[1] for window in c.BOARD_WINDOWS if window != "all")
+        old_keys = {}
+        day_keys = {}
+        for when, name, score, mode in records:
+            if mode not in c.GAME_MODES and mode != c.ALL_MODES:
+                # Logged before the server checked modes; a mode the game doesn't have gets no boards
+                continue
+            if when < running_since:
+                cache, cache_key, window = old_keys, mode, "all"
+            else:
+                # Every board key depends only on the mode and the UTC day
+                cache, cache_key, window = day_keys, (mode, int(when // 86400)), None
+            keys = cache.get(cache_key)
+            if keys is None:
+                keys = [(key, expires) for key, expires in board_keys(mode, when)
+                        if (window is None or expires is None) and shard_of(key, self.shards) == self.shard]
+                cache[cache_key] = keys
+            if keys:
+                self.submit(now, name, score, keys)
+
+    def read_snapshot(self):
+        """ Returns the boards in the snapshot and the log length it covers, or None if there isn't
+            a usable one.
+        """
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                data = f.read()
+            magic, version, shard, shards, log_length, count = self.snapshot_header.unpack_from(data)
+            if magic != self.snapshot_magic or version != self.version:
+                return None
+            if (shard, shards) != (self.shard, self.shards):
+                return None
+            offset = self.snapshot_header.size
+            boards = {}
+            for _ in range(count):
+                expires, index_count, rows, length = self.board_header.unpack_from(data, offset)
+                offset += self.board_header.size
+                key = data[offset:offset + length].decode("utf-8")
+                offset += length
+                scores = []
+                for _ in range(rows):
+                    index, score, length = self.snapshot_row.unpack_from(data, offset)
+                    offset += self.snapshot_row.size
+                    scores.append((decode_name(data[offset:offset + length]), score, index))
+                    offset += length
+                board = Board(expires or None)
+                board.restore(scores, index_count)
+                boards[key] = board
+        except (OSError, ValueError, struct.error):
+            return None
+        return boards, log_length
+
+    def write_snapshot(self, log_length):
+        chunks = [self.snapshot_header.pack(self.snapshot_magic, self.version, self.shard, self.shards,
+                                            log_length, len(self.boards))]
+        for key, board in self.boards.items():
+            rows = board.top()
+            encoded_key = key.encode("utf-8")
+            chunks.append(self.board_header.pack(board.expires or 0, board.index_count, len(rows),
+                                                 len(encoded_key)))
+            chunks.append(encoded_key)
+            for name, score, index in rows:
+                name = encode_name(name)
+                chunks.append(self.snapshot_row.pack(index, score, len(name)))
+                chunks.append(name)
+        with open(self.snapshot_path + ".tmp", "wb") as f:
+            f.write(b"".join(chunks))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.snapshot_path + ".tmp", self.snapshot_path)
+
+
+class LeaderboardService:
+    """ Daily, weekly and all time leaderboards for every game mode, sharded across worker processes.
+
+        Each board lives in the worker its key hashes to, so submissions to different boards never
+        wait on each other. A submission counts towards the all time, daily and weekly boards of its
+        mode and of ALL_MODES; the service sends each worker involved one message covering all of
+        its boards. Time windowed boards are keyed by their period, so a new period starts a new
+        board, and workers drop boards once their period is over.
+
+        Submissions are appended to an on-disk log, fsynced at most every SCORE_SYNC_INTERVAL
+        seconds by update. Every LEADERBOARD_SNAPSHOT_INTERVAL submissions, and on close, each
+        worker snapshots its boards. A worker rebuilds its boards from its snapshot and the log
+        when it starts, in its own process, so the boards survive restarts of the server and of the
+        worker without holding up the server. The log itself is never rewritten.
+
+        Like ScoreVerifier, requests never block. Call finished regularly to collect their results.
+    """
+
+    log_magic = b"LMLB"
+    version = 1
+    log_header = struct.Struct("!4sB")      # magic, version
+    log_record = struct.Struct("!dqBH")     # time, score, mode length, name length
+
+    def __init__(self, workers=c.LEADERBOARD_WORKERS, log_path=c.LEADERBOARD_LOG_PATH,
+                 snapshot_path=c.LEADERBOARD_SNAPSHOT_PATH):
+        self.log_path = log_path
+        self.snapshot_path = snapshot_path
+        self.since_snapshot = 0
+        self.unsynced = False
+        self.last_sync = time.time()
+        self.log = None
+        self.load()
+        self.results = multiprocessing.Queue()
+        self.inboxes = [None] * workers
+        self.workers = [None] * workers
+        for shard in range(workers):
+            self.start_worker(shard)
+        self.tokens = itertools.count()
+        # Board keys by mode and UTC day, which is all they depend on
+        self.day_keys = {}
+        # Shards and entries of requests, by the tokens of the messages still to be answered
+        self.pending = {}
+
+    def load(self):
+        """ Opens the log for appending, starting it if it's missing or was cut short before its
+            header was written.
+        """
+        try:
+            size = os.path.getsize(self.log_path)
+        except OSError:
+            size = 0
+        if size < self.log_header.size:
+            with open(self.log_path, "wb") as f:
+                f.write(self.log_header.pack(self.log_magic, self.version))
+        _, length = self.read_log(self.log_path, self.log_header.size, None, decode=False)
+        self.log = open(self.log_path, "r+b")
+        # Drop a record cut short by a crash mid-write, so new records follow a whole one
+        self.log.truncate(length)
+        self.log.seek(length)
+
+    @classmethod
+    def read_log(cls, path, start, end, decode=True):
+        """ Returns the records of the log at path from byte start to end, or the end of the file if
+            end is None, as (time, name, score, mode) tuples, along with the position just after
+            the last whole record. Without decode, only that position is worked out.
+        """
+        with open(path, "rb") as f:
+            magic, version = cls.log_header.unpack(f.read(cls.log_header.size))
+            if magic != cls.log_magic or version != cls.version:
+                raise ValueError(f"{path} is not a leaderboard log, or is from an incompatible version.")
+            f.seek(start)
+            data = f.read() if end is None else f.read(end - start)
+
+        records = []
+        position = 0
+        while position + cls.log_record.size <= len(data):
+            when, score, mode_length, name_length = cls.log_record.unpack_from(data, position)
+            record_start = position + cls.log_record.size
+            record_end = record_start + mode_length + name_length
+            if record_end > len(data):
+                break
+            if decode:
+                mode = data[record_start:record_start + mode_length].decode("utf-8", "replace")
+                records.append((when, decode_name(data[record_start + mode_length:record_end]), score, mode))
+            position = record_end
+        return records, start + position
+
+    def start_worker(self, shard):
+        """ Starts the worker of a shard, which rebuilds its boards from the log written so far. """
+        # The worker reads the log itself, so it has to be on disk, though not necessarily synced
+        self.log.flush()
+        inbox = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=run_shard, daemon=True,
+                                         args=(inbox, self.results, shard, len(self.inboxes), self.log_path,
+                                               self.snapshot_path, self.log.tell()))
+        worker.start()
+        self.inboxes[shard] = inbox
+        self.workers[shard] = worker
+
+    def send(self, key, kind, arguments, entry):
+        token = next(self.tokens)
+        shard = shard_of(key, len(self.inboxes))
+        self.inboxes[shard].put((kind, token, arguments))
+        self.pending[token] = (shard, entry)
+
+    def submit(self, name, score, mode=c.DEFAULT_MODE, when=None, context=None):
+        """ Records a score on every board it counts towards. Its result is a dict of the player's
+            rank on each of those boards, by board key. Raises ValueError if the mode isn't one of
+            GAME_MODES or ALL_MODES.
+        """
+        if mode not in c.GAME_MODES and mode != c.ALL_MODES:
+            raise ValueError(f"Unknown game mode {mode!r}.")
+        when = time.time() if when is None else when
+        encoded_mode, encoded_name = str(mode).encode("utf-8")[:0xFF], encode_name(name)
+        self.log.write(self.log_record.pack(when, score, len(encoded_mode), len(encoded_name)))
+        self.log.write(encoded_mode + encoded_name)
+        self.unsynced = True
+        self.since_snapshot += 1
+
+        day = int(when // 86400)
+        keys = self.day_keys.get((mode, day))
+        if keys is None:
+            if len(self.day_keys) > 64:
+                self.day_keys.clear()
+            keys = self.day_keys[mode, day] = board_keys(mode, when)
+        shards = {}
+        for key, expires in keys:
+            shards.setdefault(shard_of(key, len(self.inboxes)), []).append((key, expires))
+        # The request's messages share one entry, which collects every shard's ranks
+        entry = {"context": context, "parts": len(shards), "ranks": {}}
+        for keys in shards.values():
+            self.send(keys[0][0], "submit", (name, score, keys), entry)
+
+    def query(self, window, mode=c.DEFAULT_MODE, rows=10, name=None, when=None, context=None):
+        """ Fetches the current board of a window and mode. Its result is a dict with the board key,
+            a Scoreboard of its best rows scores and the rank of name's best score, or None. A query
+            that fails has {"success": False} as its result instead.
+        """
+        key, _ = board_key(window, mode, when)
+        self.send(key, "query", (key, rows, name), {"context": context, "board": key, "rows": rows})
+
+    def finished(self):
+        """ Returns a list of (context, result) for every request that completed since the last call.
+            Requests waiting on a worker that died fail, and the worker is replaced by a new one.
+        """
+        done = []
+        while True:
+            try:
+                token, result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if token in self.pending:
+                self.complete(token, result, done)
+        for shard, worker in enumerate(self.workers):
+            if not worker.is_alive():
+                print(f"Leaderboard worker {shard} died; starting a new one.")
+                self.start_worker(shard)
+                for token in [token for token, (owner, _) in self.pending.items() if owner == shard]:
+                    self.complete(token, None, done)
+        return done
+
+    def complete(self, token, result, done):
+        """ Records the result of a message, or None if it failed, adding the request to done if
+            that was the last message it waited on.
+        """
+        _, entry = self.pending.pop(token)
+        if "ranks" in entry:
+            # A shard that failed leaves its boards out of the ranks
+            entry["ranks"].update(result or {})
+            entry["parts"] -= 1
+            if entry["parts"] == 0:
+                done.append((entry["context"], entry["ranks"]))
+        elif result is None:
+            done.append((entry["context"], {"success": False}))
+        else:
+            rows, rank = result
+            scores = Scoreboard(entry["rows"], entry["rows"])
+            scores.restore([Score(name, score, index) for name, score, index in rows], 0)
+            done.append((entry["context"], {"board": entry["board"], "scores": scores, "rank": rank}))
+
+    def sync(self):
+        if self.unsynced:
+            self.log.flush()
+            os.fsync(self.log.fileno())
+            self.unsynced = False
+        self.last_sync = time.time()
+
+    def snapshot(self):
+        """ Has every worker snapshot its boards. The snapshots cover the log written so far, since
+            workers handle requests in order.
+        """
+        self.sync()
+        for inbox in self.inboxes:
+            # Nothing waits on the result, so it goes out without a token
+            inbox.put(("snapshot", None, self.log.tell()))
+        self.since_snapshot = 0
+
+    def update(self):
+        """ Call regularly. Syncs the log and has snapshots taken when they're due. """
+        if self.since_snapshot >= c.LEADERBOARD_SNAPSHOT_INTERVAL:
+            self.snapshot()
+        elif self.unsynced and time.time() > self.last_sync + c.SCORE_SYNC_INTERVAL:
+            self.sync()
+
+    def close(self):
+        if self.since_snapshot:
+            self.snapshot()
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for worker in self.workers:
+            # Long enough for a worker to finish its snapshot
+            worker.join(timeout=5.0)
+            if worker.is_alive():
+                worker.terminate()
+        if self.log is not None:
+            self.sync()
+            self.log.close()
+            self.log = None
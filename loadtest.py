@@ -0,0 +1,115 @@
+""" Load test of the score server's connection handling.
+
+    Opens many simultaneous connections with lightweight asyncio clients. Once all of them are
+    connected, each makes a series of requests, alternating score pushes with scoreboard requests.
+    Without --host, an AsyncServo with a stand-in handler is started in this process:
+
+        python loadtest.py --clients 2000 --requests 5
+"""
+
+import argparse
+import asyncio
+import statistics
+import struct
+import threading
+import time
+
+import numpy as np
+
+from sprocket import AsyncServo, Packet
+from scoreboard import Scoreboard
+
+
+def frame(**kwargs):
+    data = Packet(**kwargs).to_bytes()
+    return struct.pack("!Q", len(data)) + data
+
+
+async def read_packet(reader):
+    header = await reader.readexactly(8)
+    return Packet.from_bytes(await reader.readexactly(struct.unpack("!Q", header)[0]))
+
+
+async def stand_in_client(host, port, requests, connected, start, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    connected.append(writer)
+    await start.wait()
+    try:
+        for i in range(requests):
+            sent = time.perf_counter()
+            if i % 2:
+                writer.write(frame(type="print"))
+            else:
+                writer.write(frame(type="push", score=i, name="LOAD"))
+            await writer.drain()
+            await read_packet(reader)
+            latencies.append(time.perf_counter() - sent)
+    finally:
+        writer.close()
+
+
+async def run_clients(host, port, clients, requests, timeout):
+    connected = []
+    latencies = []
+    start = asyncio.Event()
+    tasks = [asyncio.ensure_future(stand_in_client(host, port, requests, connected, start, latencies))
+             for _ in range(clients)]
+    connect_start = time.perf_counter()
+    while len(connected) + sum(task.done() for task in tasks) < clients:
+        await asyncio.sleep(0.01)
+    connect_time = time.perf_counter() - connect_start
+    open_connections = len(connected)
+
+    request_start = time.perf_counter()
+    start.set()
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    request_time = time.perf_counter() - request_start
+    for task in pending:
+        task.cancel()
+    failed = sum(1 for task in done if task.exception() is not None) + len(pending)
+    return open_connections, failed, connect_time, request_time, latencies
+
+
+def serve_stand_in(servo, stop):
+    """ Answers packets like ScoreServer, without storage or replay verification. """
+    scoreboard = Scoreboard()
+    while not stop.is_set():
+        for packet in servo.get():
+            if packet.get("type") == "push":
+                scoreboard.push(packet.name, packet.score)
+                servo.send(packet.client_id, success=True)
+            else:
+                servo.send(packet.client_id, scores=scoreboard.top())
+        time.sleep(0.001)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the score server with many clients.")
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=5, help="requests per client")
+    parser.add_argument("--host", help="server to test; by default one is started in this process")
+    parser.add_argument("--port", type=int, default=41399)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    servo = None
+    stop = threading.Event()
+    if args.host is None:
+        servo = AsyncServo(port=args.port, verbose=False)
+        threading.Thread(target=serve_stand_in, args=(servo, stop), daemon=True).start()
+
+    connections, failed, connect_time, request_time, latencies = asyncio.run(
+        run_clients(args.host or "localhost", args.port, args.clients, args.requests, args.timeout))
+
+    stop.set()
+    if servo is not None:
+        servo.close()
+
+    print(f"clients connected    {connections}/{args.clients} in {connect_time:.2f} s")
+    print(f"clients failed       {failed}")
+    print(f"requests answered    {len(latencies)} in {request_time:.2f} s "
+          f"({len(latencies)/request_time:.0f}/s)")
+    if latencies:
+        p50, p99 = np.percentile(latencies, (50, 99))
+        print(f"latency              p50 {p50*1000:.1f} ms, p99 {p99*1000:.1f} ms, "
+              f"mean {statistics.mean(latencies)*1000:.1f} ms")
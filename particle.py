@@ -1,6 +1,6 @@
 import pygame
+import numpy as np
 import constants as c
-import random
 
 
 class Particle:
@@ -47,25 +47,83 @@ class Particle:
             self.game.text_particles.remove(self)
 
 
-class Chunk(Particle):
-    def __init__(self, game, position):
-        color = random.choice([(255, 200, 150),
-                               (225, 225, 100),
-                               (235, 235, 200)])
-        surface = pygame.Surface((5, 5))
-        surface.fill(color)
-        xv = random.random()**2 * 250 - 100 + 0.5 * game.player.velocity[0] * random.random()
-        yv = random.random()**2 * 400 - 200 + 0.7 * game.player.velocity[1] * random.random()
-        self.radius = 0
-        super().__init__(game, surface, position, rotation=0, angle=0, velocity=(xv, yv), gravity=800)
+class ChunkPool:
+    """ All of the small debris chunks thrown off by destroyed lanterns, stored as rows of one NumPy
+        array so they can be moved, bounced, culled and drawn in a handful of vectorized passes.
+    """
+
+    X, Y, VX, VY, GRAVITY, AGE, COLOR = range(7)
+    colors = [(255, 200, 150),
+              (225, 225, 100),
+              (235, 235, 200)]
+    size = 5
+    decel = 0.7
+
+    def __init__(self, game, capacity=1024):
+        self.game = game
+        self.data = np.zeros((capacity, 7))
+        self.count = 0
+        self.surfs = []
+        for color in self.colors:
+            surf = pygame.Surface((self.size, self.size))
+            surf.fill(color)
+            self.surfs.append(surf)
+
+    def __len__(self):
+        return self.count
+
+    def spawn(self, position, amount=30, gravity=800):
+        game = self.game
+        if self.count + amount > len(self.data):
+            grown = np.zeros((max(len(self.data)*2, self.count + amount), 7))
+            grown[:self.count] = self.data[:self.count]
+            self.data = grown
+        for row in self.data[self.count:self.count + amount]:
+            row[self.COLOR] = game.random.randrange(len(self.colors))
+            row[self.VX] = game.random.random()**2 * 250 - 100 + 0.5 * game.player.velocity[0] * game.random.random()
+            row[self.VY] = game.random.random()**2 * 400 - 200 + 0.7 * game.player.velocity[1] * game.random.random()
+        new = self.data[self.count:self.count + amount]
+        new[:, self.X] = position[0]
+        new[:, self.Y] = position[1]
+        new[:, self.GRAVITY] = gravity
+        new[:, self.AGE] = 0
+        self.count += amount
 
     def update(self, dt, events):
-        super().update(dt, events)
-        decel = 0.7
-        if self.game.walls.is_too_far_left(self):
-            self.velocity = (abs(self.velocity[0])*decel, self.velocity[1])
-        elif self.game.walls.is_too_far_right(self):
-            self.velocity = (-abs(self.velocity[0])*decel, self.velocity[1])
+        if not self.count:
+            return
+        data = self.data[:self.count]
+        data[:, self.X] += data[:, self.VX] * dt
+        data[:, self.Y] += data[:, self.VY] * dt
+        data[:, self.VY] -= data[:, self.GRAVITY] * dt
+        data[:, self.AGE] += dt
+
+        # Bounce off the walls, losing some speed
+        left = c.MIDDLE_X - self.game.walls.width//2
+        right = c.MIDDLE_X + self.game.walls.width//2
+        too_far_left = data[:, self.X] < left
+        too_far_right = ~too_far_left & (data[:, self.X] > right)
+        data[too_far_left, self.VX] = np.abs(data[too_far_left, self.VX]) * self.decel
+        data[too_far_right, self.VX] = -np.abs(data[too_far_right, self.VX]) * self.decel
+
+        # Compact the surviving chunks to the front of the array
+        alive = data[:, self.Y] >= self.game.y_offset - 200
+        survivors = data[alive]
+        self.count = len(survivors)
+        self.data[:self.count] = survivors
+
+    def draw(self, surface):
+        if not self.count:
+            return
+        data = self.data[:self.count]
+        shake = self.game.shake_offset
+        xs = (data[:, self.X] + shake - self.size/2).astype(int)
+        ys = (self.game.game_to_screen_y(data[:, self.Y]) + shake - self.size/2).astype(int)
+        visible = (ys > -self.size) & (ys < c.WINDOW_HEIGHT)
+        surfs = self.surfs
+        surface.blits([(surfs[color], (x, y)) for color, x, y in
+                       zip(data[visible, self.COLOR].astype(int).tolist(), xs[visible].tolist(), ys[visible].tolist())],
+                      doreturn=False)
 
 
 class Fadeout(Particle):
@@ -2,13 +2,19 @@ import pygame
 import constants as c
 import math
 import time
-import os
+import assets
 
 from enemy import TutorialEnemy
 
 
 class Player:
 
+    # Halo and wing sprites are shared by every Player, and built by the first one
+    halo_steps = 64
+    halos = None
+    left_wings = None
+    right_wings = None
+
     def __init__(self, game):
         self.game = game
 
@@ -20,18 +26,20 @@ class Player:
         self.max_fall_speed = 600
         self.cutting = False
         self.cut_so_far = 0
+        # How far along the current cut it enters each lantern it was aimed through
+        self.cut_entries = {}
         self.flying = False
         self.fly_start = 0
-        self.rwing = pygame.image.load(os.path.join(c.ASSETS_PATH, "wing.png")).convert()
+        self.rwing = assets.image("wing.png").convert()
         self.lwing = pygame.transform.flip(self.rwing, 1, 0).convert()
         self.rwing.set_colorkey(c.BLACK)
         self.lwing.set_colorkey(c.BLACK)
         self.wing_alpha = 0
         self.wing_gauge_max = 12
         self.wing_gauge_current = 0
-        self.wing_gauge_back = pygame.image.load(os.path.join(c.ASSETS_PATH, "wing_gauge.png"))
-        self.wing_gauge_front = pygame.image.load(os.path.join(c.ASSETS_PATH, "wing_gauge_full.png"))
-        self.wing_gauge_full = pygame.image.load(os.path.join(c.ASSETS_PATH, "wing_gauge_100.png"))
+        self.wing_gauge_back = assets.image("wing_gauge.png")
+        self.wing_gauge_front = assets.image("wing_gauge_full.png")
+        self.wing_gauge_full = assets.image("wing_gauge_100.png")
         for gauge in [self.wing_gauge_back, self.wing_gauge_front, self.wing_gauge_full]:
             gauge.set_colorkey((255, 0, 255))
         size = 70, 35
@@ -41,7 +49,7 @@ class Player:
         self.wing_gauge_back.set_alpha(95)
         self.wing_gauge_front.set_alpha(170)
 
-        self.surf = pygame.image.load(os.path.join(c.ASSETS_PATH, "player.png"))
+        self.surf = assets.image("player.png")
 
         self.cut_distance = 250
         self.cut_speed = 1500
@@ -53,6 +61,38 @@ class Player:
         # Radius for collisions
         self.radius = 10
 
+        if Player.halos is None:
+            self.build_halos()
+            self.build_wings()
+
+    def build_halos(self):
+        """ Pre-renders the medium and large halos for each step of speed from 0 to max_speed. """
+        halos = []
+        for step in range(self.halo_steps + 1):
+            prop = step/self.halo_steps
+            msize = 3 + 3*prop
+            medium = pygame.Surface((self.radius * msize, self.radius * msize))
+            pygame.draw.circle(medium, c.WHITE, (int(self.radius*msize//2), int(self.radius*msize//2)), int(self.radius*msize//2))
+            medium.set_colorkey(c.BLACK)
+            medium.set_alpha(100 + 20*prop)
+
+            lsize = 4 + 6*prop
+            color_bump = int(50*prop)
+            large = pygame.Surface((self.radius * lsize, self.radius * lsize))
+            pygame.draw.circle(large, (100 + color_bump//2, 150 + color_bump//2, 255),
+                               (int(self.radius*lsize//2),
+                                int(self.radius*lsize//2)),
+                               int(self.radius*lsize//2))
+            large.set_colorkey(c.BLACK)
+            large.set_alpha(40 + 40*prop)
+            halos.append((medium, large))
+        Player.halos = halos
+
+    def build_wings(self):
+        """ Pre-rotates both wings to every whole degree of their flapping range. """
+        Player.left_wings = {rot: pygame.transform.rotate(self.lwing, -rot) for rot in range(-30, 31)}
+        Player.right_wings = {rot: pygame.transform.rotate(self.rwing, rot) for rot in range(-30, 31)}
+
     @property
     def has_wings(self):
         return (self.wing_gauge_current == self.wing_gauge_max)
@@ -83,6 +123,7 @@ class Player:
 
         self.cut_so_far = 0
         self.cutting = True
+        self.cut_entries = dict(self.game.slice.touched)
 
         rel_x = position[0] - self.x
         rel_y = position[1] - self.y
@@ -150,8 +191,14 @@ class Player:
             self.x = c.MIDDLE_X + self.game.walls.width // 2 - self.radius
             self.game.shake_effect(4)
 
-        for enemy in self.game.enemies:
-            if self.colliding_with(enemy) and (self.velocity[1] > 550 or self.cutting) and not self.flying:
+        reach = self.game.enemies.max_radius
+        colliding = [enemy for enemy in self.game.enemies.window(self.y - reach, self.y + reach)
+                     if self.colliding_with(enemy)]
+        if self.cutting:
+            # Lanterns reached in the same frame are cut in the order the cut enters them
+            colliding.sort(key=lambda enemy: self.cut_entries.get(enemy, math.inf))
+        for enemy in colliding:
+            if (self.velocity[1] > 550 or self.cutting) and not self.flying:
                 self.slice(enemy)
 
         if self.flying:
@@ -168,6 +215,7 @@ class Player:
 
         if self.cut_so_far >= self.cut_distance:
             self.cutting = False
+            self.cut_entries = {}
 
         self.apply_max_velocity()
 
@@ -239,8 +287,8 @@ class Player:
             rot = math.sin(self.age*2) * 30
             width = 35 - 0.12*rot
             offset = rot*0.7 + 24
-            new_left = pygame.transform.rotate(self.lwing, -rot)
-            new_right = pygame.transform.rotate(self.rwing, rot)
+            new_left = self.left_wings[round(rot)]
+            new_right = self.right_wings[round(rot)]
             new_left.set_alpha(max(self.wing_alpha + rot, 0))
             new_right.set_alpha(max(self.wing_alpha + rot, 0))
             surface.blit(new_right,
@@ -249,21 +297,8 @@ class Player:
                          (x - new_left.get_width() // 2 - width, y - new_left.get_height() // 2 - offset))
 
         mag = (self.velocity[0]**2 + self.velocity[1]**2) ** 0.5
-        msize = (3 + 3*mag/self.max_speed)
-        medium = pygame.Surface((self.radius * msize, self.radius * msize))
-        pygame.draw.circle(medium, c.WHITE, (int(self.radius*msize//2), int(self.radius*msize//2)), int(self.radius*msize//2))
-        medium.set_colorkey(c.BLACK)
-        medium.set_alpha(100 + 20*mag/self.max_speed)
-
-        lsize = 4 + 6*mag/self.max_speed
-        color_bump = int(50*mag/self.max_speed)
-        large = pygame.Surface((self.radius * lsize, self.radius * lsize))
-        pygame.draw.circle(large, (100 + color_bump//2, 150 + color_bump//2, 255),
-                           (int(self.radius*lsize//2),
-                            int(self.radius*lsize//2)),
-                           int(self.radius*lsize//2))
-        large.set_colorkey(c.BLACK)
-        large.set_alpha(40 + 40 * mag/self.max_speed)
+        step = int(min(mag/self.max_speed, 1) * self.halo_steps)
+        medium, large = self.halos[step]
 
         surface.blit(medium, (x - medium.get_width()//2, y - medium.get_width()//2))
         surface.blit(large, (x - large.get_width()//2, y - large.get_width()//2))
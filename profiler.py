@@ -0,0 +1,110 @@
+import csv
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+import constants as c
+import fonts
+
+
+__all__ = ["FrameProfiler"]
+
+
+class FrameProfiler:
+    """ Lap timer for the phases of each frame.
+
+        Call start_frame at the top of the loop, mark after each phase with the phase's name, and
+        end_frame at the bottom. Time between two marks is charged to the later mark's phase, and
+        phases marked more than once in a frame accumulate. While disabled every call returns
+        immediately.
+    """
+
+    def __init__(self, history=c.PROFILE_HISTORY):
+        self.enabled = False
+        self.frames = deque(maxlen=history)
+        self.phases = []
+        self.current = {}
+        self.last = 0
+        self.overlay_lines = []
+        self.since_overlay = 0
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.frames.clear()
+        self.overlay_lines = []
+        # Turned on mid-frame, the rest of this frame would be timed from a stale start; skip it
+        self.current = None
+
+    def start_frame(self):
+        if not self.enabled:
+            return
+        self.current = {}
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        if not self.enabled or self.current is None:
+            return
+        now = time.perf_counter()
+        self.current[phase] = self.current.get(phase, 0) + now - self.last
+        self.last = now
+
+    def end_frame(self):
+        if not self.enabled or self.current is None:
+            return
+        for phase in self.current:
+            if phase not in self.phases:
+                self.phases.append(phase)
+        self.frames.append(self.current)
+
+    def percentiles(self, phase, points=(50, 95, 99)):
+        """ Returns the given percentiles of a phase's duration over the recorded frames, in seconds. """
+        durations = [frame.get(phase, 0) for frame in self.frames]
+        if not durations:
+            return [0 for _ in points]
+        return list(np.percentile(durations, points))
+
+    def totals(self):
+        """ Returns the total duration of each recorded frame, excluding time spent idle. """
+        return [sum(frame[phase] for phase in frame if phase != "idle") for frame in self.frames]
+
+    def draw(self, surface):
+        if not self.enabled:
+            return
+        self.since_overlay += 1
+        if self.since_overlay >= c.PROFILE_OVERLAY_INTERVAL or not self.overlay_lines:
+            self.since_overlay = 0
+            self.overlay_lines = self.overlay_text()
+        y = 5
+        for line in self.overlay_lines:
+            surf = fonts.render("gothland.ttf", 14, line, 0, c.WHITE)
+            surface.blit(surf, (5, y))
+            y += surf.get_height()
+
+    def overlay_text(self):
+        lines = ["phase          p50    p95    p99 (ms)"]
+        for phase in self.phases:
+            p50, p95, p99 = self.percentiles(phase)
+            lines.append(f"{phase:<12} {p50*1000:6.2f} {p95*1000:6.2f} {p99*1000:6.2f}")
+        totals = self.totals()
+        if totals:
+            p50, p95, p99 = np.percentile(totals, (50, 95, 99))
+            lines.append(f"{'busy':<12} {p50*1000:6.2f} {p95*1000:6.2f} {p99*1000:6.2f}")
+            over = sum(1 for total in totals if total > 1/c.MAX_FPS)
+            lines.append(f"over budget: {over}/{len(totals)} frames")
+        return lines
+
+    def export(self, path):
+        """ Writes the recorded frames to disk, as JSON if the path ends with .json and CSV otherwise.
+            Durations are in milliseconds.
+        """
+        rows = [[frame.get(phase, 0) * 1000 for phase in self.phases] for frame in self.frames]
+        if path.endswith(".json"):
+            with open(path, "w") as f:
+                json.dump({"phases": self.phases, "frames": rows}, f)
+        else:
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(self.phases)
+                writer.writerows(rows)
@@ -0,0 +1,82 @@
+import struct
+import time
+
+
+__all__ = ["Replay"]
+
+
+class Replay:
+    """ Seed and per-frame inputs of a single run, enough to re-simulate it exactly.
+
+        Each frame holds the real time step passed to Simulation.step, the mouse position in screen
+        coordinates and the inputs received that frame.
+    """
+
+    magic = b"LMRP"
+    version = 1
+    header = struct.Struct("!4sBII")   # magic, version, seed, frame count
+    frame = struct.Struct("!dhhB")     # dt, mouse x, mouse y, number of inputs
+
+    def __init__(self, seed, frames=None):
+        self.seed = seed
+        self.frames = frames if frames is not None else []
+
+    def __len__(self):
+        return len(self.frames)
+
+    def record(self, dt, inputs, mouse_position):
+        self.frames.append((dt, tuple(inputs), (int(mouse_position[0]), int(mouse_position[1]))))
+
+    def duration(self):
+        """ Returns the real time covered by the replay, in seconds. """
+        return sum(frame[0] for frame in self.frames)
+
+    def play(self, simulation, stop_on_death=True, deadline=None):
+        """ Resets the simulation with the recorded seed and steps it through every frame as fast as
+            possible. Returns the final score, or None if time.time() passes deadline first.
+        """
+        simulation.reset(self.seed)
+        for i, (dt, inputs, mouse_position) in enumerate(self.frames):
+            if deadline is not None and i % 60 == 0 and time.time() > deadline:
+                return None
+            simulation.step(dt, inputs, mouse_position)
+            if stop_on_death and simulation.player_is_dead():
+                break
+        return simulation.score()
+
+    def to_bytes(self):
+        chunks = [self.header.pack(self.magic, self.version, self.seed, len(self.frames))]
+        for dt, inputs, (x, y) in self.frames:
+            chunks.append(self.frame.pack(dt, x, y, len(inputs)))
+            chunks.append(bytes(inputs))
+        return b"".join(chunks)
+
+    @classmethod
+    def read_header(cls, data):
+        """ Returns the seed and frame count of a serialized replay, without reading its frames. """
+        magic, version, seed, count = cls.header.unpack_from(data, 0)
+        if magic != cls.magic or version != cls.version:
+            raise ValueError("Not a replay, or a replay from an incompatible version.")
+        return seed, count
+
+    @classmethod
+    def from_bytes(cls, data):
+        seed, count = cls.read_header(data)
+        offset = cls.header.size
+        frames = []
+        for _ in range(count):
+            dt, x, y, n = cls.frame.unpack_from(data, offset)
+            offset += cls.frame.size
+            inputs = tuple(data[offset:offset + n])
+            offset += n
+            frames.append((dt, inputs, (x, y)))
+        return cls(seed, frames)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
@@ -1,33 +1,32 @@
+from bisect import bisect_left, insort
+from heapq import merge
+from itertools import islice
+
+
 class Score:
     def __init__(self, name, score, index):
         self.name = name
         self.score = score
         self.index = index
 
+    def key(self):
+        """ Higher keys rank higher. Of two equal scores, the later one ranks higher. """
+        return self.score, self.index
+
     def __eq__(self, other):
-        return 0
+        return self.key() == other.key()
 
     def __gt__(self, other):
-        if self.score > other.score:
-            return True
-        elif self.score == other.score and self.index > other.index:
-            return True
-        else:
-            return False
+        return self.key() > other.key()
 
     def __le__(self, other):
-        return not self.__gt__(other)
+        return self.key() <= other.key()
 
     def __lt__(self, other):
-        if self.score < other.score:
-            return True
-        elif self.score == other.score and self.index < other.index:
-            return True
-        else:
-            return False
+        return self.key() < other.key()
 
     def __ge__(self, other):
-        return not self.__lt__(other)
+        return self.key() >= other.key()
 
     def __str__(self):
         spaces = max(0, 12 - len(self.name)) * " "
@@ -35,6 +34,12 @@ class Score:
 
 
 class Scoreboard:
+    """ The best max_rows scores, best first.
+
+        Scores are kept sorted as they're pushed, alongside a list of negated sort keys that can be
+        bisected. Pushes and rank queries are a bisection and a single list insertion rather than a
+        sort of the board.
+    """
 
     data = None
 
@@ -52,12 +57,108 @@ class Scoreboard:
 
     def clear(self):
         self.data = [Score("Empty", 0, self.new_index()) for _ in range(self.max_rows)]
+        self.data.reverse()
+        self.keys = [sort_key(item) for item in self.data]
 
     def push(self, name, score):
-        new = Score(name, score, self.new_index())
-        self.data.append(new)
-        self.data.sort(reverse=True)
-        self.data = self.data[:self.max_rows]
+        """ Adds a score to the board. Returns its rank, counting from 0, or None if it didn't make
+            the board.
+        """
+        return self.insert(Score(name, score, self.new_index()))
+
+    def push_all(self, pushes):
+        """ Adds (name, score) pairs to the board, as pushing them in order would, with a single merge
+            of the board. Returns the ranks each push would have returned, in the same order.
+        """
+        new = [Score(name, score, self.new_index()) for name, score in pushes]
+        # A push's rank counts the scores ahead of it on the board and earlier in the batch. A count
+        # past the end of the board means it wouldn't have made it.
+        ranks = []
+        earlier = []
+        for item in new:
+            key = sort_key(item)
+            rank = bisect_left(self.keys, key) + bisect_left(earlier, key)
+            insort(earlier, key)
+            ranks.append(rank if rank < self.max_rows else None)
+
+        added = sorted((sort_key(item), item) for item in new)
+        # Keys are unique, so the pairs never compare their scores
+        rows = list(islice(merge(zip(self.keys, self.data), added), self.max_rows))
+        self.keys = [key for key, _ in rows]
+        self.data = [item for _, item in rows]
+        return ranks
+
+    def insert(self, new):
+        """ Adds a Score that already has its index, as one from another board. Returns its rank as
+            push does.
+        """
+        key = sort_key(new)
+        rank = bisect_left(self.keys, key)
+        if rank >= self.max_rows:
+            return None
+        self.keys.insert(rank, key)
+        self.data.insert(rank, new)
+        if len(self.data) > self.max_rows:
+            self.keys.pop()
+            self.data.pop()
+        return rank
+
+    def restore(self, scores, index_count):
+        """ Replaces the board with scores, which must already be best first, as from data. """
+        self.data = list(scores[:self.max_rows])
+        self.keys = [sort_key(item) for item in self.data]
+        self.index_count = index_count
+
+    def rank_of(self, score):
+        """ Returns the rank a score pushed now would get, counting from 0. Ranks past the end of
+            the board mean it wouldn't make the board.
+        """
+        return bisect_left(self.keys, (-score, -self.index_count))
+
+    def find(self, name, score):
+        """ Returns the rank of the latest score pushed with this name and score, or None if it isn't
+            on the board.
+        """
+        rank = self.rank_of(score)
+        while rank < len(self.data) and self.data[rank].score == score:
+            if self.data[rank].name == name:
+                return rank
+            rank += 1
+        return None
+
+    def changes(self, since, rows=None):
+        """ Returns the scores among the best rows that were pushed once index_count had reached
+            since, best first. A board that has seen since is brought up to date by merging them.
+
+            Scores only ever move down the board, so everything else in the best rows was already in
+            that board's best rows. If since is ahead of this board, which must have been replaced in
+            the meantime, all of the best rows are returned.
+        """
+        rows = self.visible_rows if rows is None else rows
+        if since > self.index_count:
+            since = 0
+        return [item for item in self.data[:rows] if item.index >= since]
+
+    def merge(self, scores, version):
+        """ Applies the changes from another board, whose index_count was version when they were
+            taken. Changes from a board that is behind this one replace its scores outright.
+        """
+        if version < self.index_count:
+            self.restore([], 0)
+        for item in scores:
+            self.insert(item)
+        self.index_count = version
+
+    def around(self, rank, radius=2):
+        """ Returns the scores within radius places of rank, best first. """
+        return self.data[max(0, rank - radius):rank + radius + 1]
+
+    def top(self, rows=None):
+        """ Returns a new board holding only the best rows scores, by default the visible ones. """
+        rows = self.visible_rows if rows is None else rows
+        board = Scoreboard(self.visible_rows, rows)
+        board.restore(self.data[:rows], self.index_count)
+        return board
 
     def get_visible(self):
         return self.data[:self.visible_rows]
@@ -65,6 +166,21 @@ class Scoreboard:
     def get_data(self):
         return self.data[:]
 
+    def __getstate__(self):
+        # The keys can be rebuilt from data, so pickles leave them out
+        state = self.__dict__.copy()
+        del state["keys"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.keys = [sort_key(item) for item in self.data]
+
     def __str__(self):
         stringified = [str(item) for item in self.get_visible()]
-        return "\n".join(stringified)
\ No newline at end of file
+        return "\n".join(stringified)
+
+
+def sort_key(score):
+    """ Key that sorts scores best first. """
+    return -score.score, -score.index
@@ -0,0 +1,152 @@
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import Future
+
+from sprocket import FrameReader, Packet, send_frame
+import constants as c
+
+
+__all__ = ["ScoreClient", "status"]
+
+
+DISCONNECTED = "disconnected"
+CONNECTING = "connecting"
+CONNECTED = "connected"
+OFFLINE = "offline"
+
+
+class ScoreClient:
+    """ One persistent connection to the score server, shared by every request the game makes.
+
+        request returns a concurrent.futures.Future right away. A background thread connects when
+        there's something to send, reconnecting if the connection has dropped, and sends requests
+        tagged with a request id. Replies resolve the future with the same id. A future fails with
+        TimeoutError if no reply comes within its timeout, and with ConnectionError if the server
+        can't be reached or the connection drops while it waits.
+
+        resolve returns the server's (host, port), or None if it isn't known. invalidate, if given, is
+        called when connecting to the address resolve returned fails.
+    """
+
+    def __init__(self, resolve, invalidate=None):
+        self.resolve = resolve
+        self.invalidate = invalidate
+        self.state = DISCONNECTED
+        self.sock = None
+        self.socket_mutex = threading.Lock()
+        self.pending = {}
+        self.pending_mutex = threading.Lock()
+        self.outbox = queue.Queue()
+        self.last_request_id = 0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def request(self, timeout=c.TIMEOUT_TIME, **kwargs):
+        """ Sends a packet with the given fields. Returns a Future of the reply packet. """
+        future = Future()
+        with self.pending_mutex:
+            self.last_request_id = self.last_request_id % 0xFFFFFFFF + 1
+            request_id = self.last_request_id
+            self.pending[request_id] = (future, time.time() + timeout, None)
+        self.outbox.put((request_id, kwargs))
+        return future
+
+    def fail(self, request_id, exception):
+        with self.pending_mutex:
+            entry = self.pending.pop(request_id, None)
+        if entry is not None:
+            entry[0].set_exception(exception)
+
+    def expire(self):
+        now = time.time()
+        with self.pending_mutex:
+            expired = [request_id for request_id, (_, deadline, _) in self.pending.items() if now > deadline]
+        for request_id in expired:
+            self.fail(request_id, TimeoutError("The score server didn't reply in time."))
+
+    def connect(self):
+        self.state = CONNECTING
+        address = self.resolve()
+        if address is None:
+            self.state = OFFLINE
+            raise ConnectionError("The score server's address is unknown.")
+        try:
+            sock = socket.create_connection(address, timeout=c.TIMEOUT_TIME)
+        except OSError:
+            self.state = OFFLINE
+            if self.invalidate is not None:
+                self.invalidate()
+            raise
+        reader = FrameReader(sock)
+        with self.socket_mutex:
+            self.sock = sock
+            self.state = CONNECTED
+        threading.Thread(target=self.receive, args=(sock, reader), daemon=True).start()
+        return sock
+
+    def disconnect(self, sock):
+        """ Forgets a connection that failed, failing the requests that were sent on it. """
+        with self.socket_mutex:
+            if self.sock is sock:
+                self.sock = None
+                self.state = DISCONNECTED
+        sock.close()
+        with self.pending_mutex:
+            lost = [request_id for request_id, (_, _, sent_on) in self.pending.items() if sent_on is sock]
+        for request_id in lost:
+            self.fail(request_id, ConnectionError("Lost the connection to the score server."))
+
+    def receive(self, sock, reader):
+        while True:
+            try:
+                packet = reader.read_packet()
+            except (OSError, ValueError):
+                self.disconnect(sock)
+                return
+            with self.pending_mutex:
+                entry = self.pending.pop(packet.get("request_id"), None)
+            if entry is not None:
+                entry[0].set_result(packet)
+
+    def send(self, sock, request_id, fields):
+        with self.pending_mutex:
+            if request_id not in self.pending:
+                return
+            future, deadline, _ = self.pending[request_id]
+            self.pending[request_id] = (future, deadline, sock)
+        try:
+            send_frame(sock, Packet(request_id=request_id, **fields).to_bytes())
+        except OSError:
+            self.disconnect(sock)
+
+    def run(self):
+        while True:
+            try:
+                request_id, fields = self.outbox.get(timeout=c.SERVER_TICK)
+            except queue.Empty:
+                self.expire()
+                continue
+            self.expire()
+            sock = self.sock
+            if sock is None:
+                try:
+                    sock = self.connect()
+                except OSError as e:
+                    self.fail(request_id, e if isinstance(e, ConnectionError) else ConnectionError(e))
+                    continue
+            self.send(sock, request_id, fields)
+
+
+def status(future):
+    """ Returns the status constant for a finished request: SCORE_RECEIVED if it was answered,
+        TIMEOUT or NO_CONNECT if it failed.
+    """
+    exception = future.exception()
+    if exception is None:
+        return c.SCORE_RECEIVED
+    if isinstance(exception, TimeoutError):
+        return c.TIMEOUT
+    return c.NO_CONNECT
@@ -0,0 +1,172 @@
+import os
+import struct
+import time
+
+from scoreboard import Score, Scoreboard
+import constants as c
+
+
+__all__ = ["ScoreStore"]
+
+
+class ScoreStore:
+    """ Scoreboard kept on disk as an append-only log of pushes plus snapshots of the board.
+
+        Pushes are appended to the log straight away and fsynced at most every SCORE_SYNC_INTERVAL
+        seconds by update. Every SCORE_SNAPSHOT_INTERVAL pushes, and on close, the board is written
+        to the snapshot file along with the length of the log it covers, so loading only replays
+        the pushes logged after the latest snapshot. The log itself is never rewritten.
+    """
+
+    log_magic = b"LMSL"
+    snapshot_magic = b"LMSS"
+    version = 1
+    log_header = struct.Struct("!4sB")      # magic, version
+    log_record = struct.Struct("!qH")       # score, name length
+    # magic, version, max rows, index count, log length covered, row count
+    snapshot_header = struct.Struct("!4sBIQQI")
+    snapshot_row = struct.Struct("!qqH")    # index, score, name length
+
+    def __init__(self, log_path=c.SCORE_LOG_PATH, snapshot_path=c.SCORE_SNAPSHOT_PATH, max_rows=200):
+        self.log_path = log_path
+        self.snapshot_path = snapshot_path
+        self.scoreboard = Scoreboard(max_rows=max_rows)
+        self.since_snapshot = 0
+        self.unsynced = False
+        self.last_sync = time.time()
+        self.log = None
+        self.load()
+
+    def load(self):
+        offset = self.log_header.size
+        snapshot = self.read_snapshot()
+        if snapshot is not None and snapshot[1] <= self.log_size():
+            scores, offset, index_count = snapshot
+            self.scoreboard.restore(scores, index_count)
+
+        if not os.path.exists(self.log_path):
+            with open(self.log_path, "wb") as f:
+                f.write(self.log_header.pack(self.log_magic, self.version))
+        with open(self.log_path, "rb") as f:
+            magic, version = self.log_header.unpack(f.read(self.log_header.size))
+            if magic != self.log_magic or version != self.version:
+                raise ValueError(f"{self.log_path} is not a score log, or is from an incompatible version.")
+            f.seek(offset)
+            data = f.read()
+
+        # Only the pushes since the snapshot are read and replayed
+        position = 0
+        while position + self.log_record.size <= len(data):
+            score, length = self.log_record.unpack_from(data, position)
+            start = position + self.log_record.size
+            if start + length > len(data):
+                break
+            self.scoreboard.push(decode_name(data[start:start + length]), score)
+            self.since_snapshot += 1
+            position = start + length
+        offset += position
+
+        self.log = open(self.log_path, "r+b")
+        # Drop a record cut short by a crash mid-write, so new records follow a whole one
+        self.log.truncate(offset)
+        self.log.seek(offset)
+
+    def log_size(self):
+        try:
+            return os.path.getsize(self.log_path)
+        except OSError:
+            return 0
+
+    def read_snapshot(self):
+        """ Returns the scores, log length and index count of the snapshot, or None if there isn't a
+            usable one.
+        """
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                data = f.read()
+            magic, version, max_rows, index_count, log_length, count = self.snapshot_header.unpack_from(data)
+            if magic != self.snapshot_magic or version != self.version:
+                return None
+            if max_rows != self.scoreboard.max_rows:
+                return None
+            offset = self.snapshot_header.size
+            scores = []
+            for _ in range(count):
+                index, score, length = self.snapshot_row.unpack_from(data, offset)
+                offset += self.snapshot_row.size
+                scores.append(Score(decode_name(data[offset:offset + length]), score, index))
+                offset += length
+        except (OSError, struct.error):
+            return None
+        return scores, log_length, index_count
+
+    def write_snapshot(self):
+        self.sync()
+        board = self.scoreboard
+        chunks = [self.snapshot_header.pack(self.snapshot_magic, self.version, board.max_rows,
+                                            board.index_count, self.log.tell(), len(board.data))]
+        for item in board.data:
+            name = encode_name(item.name)
+            chunks.append(self.snapshot_row.pack(item.index, item.score, len(name)))
+            chunks.append(name)
+        with open(self.snapshot_path + ".tmp", "wb") as f:
+            f.write(b"".join(chunks))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.snapshot_path + ".tmp", self.snapshot_path)
+        self.since_snapshot = 0
+
+    def push(self, name, score):
+        """ Logs the push and adds it to the scoreboard. Returns the rank, as Scoreboard.push does. """
+        encoded = encode_name(name)
+        self.log.write(self.log_record.pack(score, len(encoded)))
+        self.log.write(encoded)
+        self.unsynced = True
+        self.since_snapshot += 1
+        return self.scoreboard.push(name, score)
+
+    def push_all(self, pushes):
+        """ Logs the (name, score) pairs with one write and adds them to the scoreboard with one merge.
+            Returns their ranks, as Scoreboard.push_all does.
+        """
+        chunks = []
+        for name, score in pushes:
+            encoded = encode_name(name)
+            chunks.append(self.log_record.pack(score, len(encoded)))
+            chunks.append(encoded)
+        self.log.write(b"".join(chunks))
+        self.unsynced = True
+        self.since_snapshot += len(pushes)
+        return self.scoreboard.push_all(pushes)
+
+    def sync(self):
+        if self.unsynced:
+            self.log.flush()
+            os.fsync(self.log.fileno())
+            self.unsynced = False
+        self.last_sync = time.time()
+
+    def update(self):
+        """ Call regularly. Syncs the log and writes snapshots when they're due. """
+        if self.since_snapshot >= c.SCORE_SNAPSHOT_INTERVAL:
+            self.write_snapshot()
+        elif self.unsynced and time.time() > self.last_sync + c.SCORE_SYNC_INTERVAL:
+            self.sync()
+
+    def close(self):
+        if self.log is None:
+            return
+        if self.since_snapshot:
+            self.write_snapshot()
+        self.sync()
+        self.log.close()
+        self.log = None
+
+
+def encode_name(name):
+    return str(name).encode("utf-8")[:0xFFFF]
+
+
+def decode_name(data):
+    # Names longer than a record allows are cut, possibly mid character
+    return data.decode("utf-8", "replace")
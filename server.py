@@ -0,0 +1,171 @@
+import sys
+import time
+
+from sprocket import AsyncServo, Packet
+from scorestore import ScoreStore
+from verifier import ScoreVerifier
+from leaderboards import LeaderboardService
+import constants as c
+import wire
+
+
+class ScoreServer:
+    """ Scoreboard server for the game's high score screen.
+
+        Clients send type="push" packets with a name and score, optionally with a replay of the run,
+        and type="print" packets to receive the scoreboard. Clients that keep a copy of the board send
+        type="sync" packets instead, with the version of their copy (since) and the rows they show
+        (top), and receive only the rows that changed since, along with the board's current version
+        and the rank of their name and score. Replies carry the request_id of the packet they answer,
+        if it had one. Pushes that carry a replay only reach the scoreboard once the replay has been
+        re-simulated to the same score. If the server can't verify it in time, the reply carries
+        busy=True along with success=False, and the push may be sent again. The scoreboard is kept
+        on disk, so it survives restarts.
+
+        Accepted scores also go to the daily, weekly and all time leaderboards of their mode (the mode
+        field, DEFAULT_MODE without one, which must be one of GAME_MODES). Clients read those with
+        type="board" packets naming the window and mode, and receive the board's key, its top rows
+        as a Scoreboard, and the rank of the best score of name, if given. The leaderboards are rebuilt from their own log on restart.
+
+        Requests are handled in batches, one per update: whatever arrived since the last one.
+    """
+
+    def __init__(self, port=41398, workers=None, require_replay=False, store=None,
+                 leaderboard_workers=c.LEADERBOARD_WORKERS):
+        self.servo = AsyncServo(port=port)
+        self.store = store if store is not None else ScoreStore()
+        self.scoreboard = self.store.scoreboard
+        self.verifier = ScoreVerifier(workers)
+        self.leaderboards = LeaderboardService(leaderboard_workers)
+        self.require_replay = require_replay
+
+        # Requests of the current batch, answered together by flush
+        self.pushes = []
+        self.prints = []
+        self.syncs = []
+        self.replies = []
+
+    def handle(self, packet):
+        kind = packet.get("type")
+        request = (packet.client_id, packet.get("request_id"))
+        if kind == "push":
+            replay = packet.get("replay")
+            mode = packet.get("mode", c.DEFAULT_MODE)
+            if not (valid_score(packet.get("score")) and valid_name(packet.get("name")) and valid_mode(mode)):
+                self.reply(request, success=False)
+            elif replay is not None:
+                if not self.verifier.submit(replay, packet.score, (request, packet.name, packet.score, mode)):
+                    self.reply(request, success=False, busy=True)
+            elif self.require_replay:
+                self.reply(request, success=False)
+            else:
+                self.pushes.append((request, packet.name, packet.score, mode))
+        elif kind == "print":
+            self.prints.append(request)
+        elif kind == "sync":
+            self.syncs.append((request, packet))
+        elif kind == "board":
+            window = packet.get("window", "all")
+            mode = packet.get("mode", c.DEFAULT_MODE)
+            top = packet.get("top")
+            name = packet.get("name")
+            if (window not in c.BOARD_WINDOWS or not (mode == c.ALL_MODES or valid_mode(mode))
+                    or not (name is None or valid_name(name))):
+                self.reply(request, success=False)
+                return
+            if not isinstance(top, int) or top < 0:
+                top = self.scoreboard.visible_rows
+            self.leaderboards.query(window, mode, min(top, self.scoreboard.max_rows), name, context=request)
+
+    def reply(self, request, **kwargs):
+        """ Queues an answer to the request, a (client id, request id) pair, for the end of the batch. """
+        client_id, request_id = request
+        if request_id is not None:
+            kwargs["request_id"] = request_id
+        self.replies.append((client_id, Packet(**kwargs).to_bytes()))
+
+    def flush(self):
+        """ Applies the batch's pushes to the scoreboard in one merge, then answers every request in
+            the batch from the merged board. Every print gets the same encoding of the scoreboard,
+            and syncs share their changes with the other syncs from the same version.
+        """
+        if self.pushes:
+            self.store.push_all([(name, score) for _, name, score, _ in self.pushes])
+            for request, name, score, mode in self.pushes:
+                self.leaderboards.submit(name, score, mode)
+                self.reply(request, success=True)
+
+        if self.prints:
+            # Clients only show the visible rows
+            scores = Packet(scores=self.scoreboard.top()).to_bytes()
+            for client_id, request_id in self.prints:
+                self.replies.append((client_id, wire.readdress(scores, request_id)))
+
+        changes = {}
+        for request, packet in self.syncs:
+            since, top = packet.get("since"), packet.get("top")
+            if not (isinstance(since, int) and isinstance(top, int) and since >= 0 and top >= 0):
+                since, top = 0, self.scoreboard.visible_rows
+            top = min(top, self.scoreboard.max_rows)
+            if (since, top) not in changes:
+                changes[since, top] = self.scoreboard.changes(since, top)
+            rank = None
+            if valid_score(packet.get("score")) and valid_name(packet.get("name")):
+                rank = self.scoreboard.find(packet.name, packet.score)
+            self.reply(request, version=self.scoreboard.index_count, scores=changes[since, top], rank=rank)
+
+        self.servo.send_encoded(self.replies)
+        self.pushes, self.prints, self.syncs, self.replies = [], [], [], []
+
+    def update(self):
+        for packet in self.servo.get():
+            self.handle(packet)
+        for (request, name, score, mode), verified in self.verifier.finished():
+            if verified:
+                self.pushes.append((request, name, score, mode))
+            elif verified is None:
+                # Not the player's fault, so they're told to try again rather than that it was rejected
+                print(f"Ran out of time verifying score {score} from {name}")
+                self.reply(request, success=False, busy=True)
+            else:
+                print(f"Rejected score {score} from {name}")
+                self.reply(request, success=False)
+        for request, result in self.leaderboards.finished():
+            # Submissions have no request to answer; the push was answered once it was accepted
+            if request is not None:
+                self.reply(request, **result)
+        self.flush()
+        self.store.update()
+        self.leaderboards.update()
+
+    def run(self):
+        try:
+            while True:
+                self.update()
+                time.sleep(c.SERVER_TICK)
+        finally:
+            self.servo.close()
+            self.verifier.close()
+            self.leaderboards.close()
+            self.store.close()
+
+
+def valid_score(score):
+    """ Scores have to fit the score log's 64 bit field. """
+    # type rather than isinstance, which would let bools through as 0 and 1
+    return type(score) is int and -2**63 <= score < 2**63
+
+
+def valid_name(name):
+    """ Names are shown on the scoreboard, so they're kept short. """
+    return isinstance(name, str) and 0 < len(name) <= c.MAX_NAME_LENGTH
+
+
+def valid_mode(mode):
+    """ Every mode gets boards of its own, so only the game's modes are accepted. """
+    return isinstance(mode, str) and mode in c.GAME_MODES
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 41398
+    ScoreServer(port).run()
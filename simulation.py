@@ -0,0 +1,325 @@
+import os
+import math
+import random
+
+import pygame
+
+from player import Player
+from walls import Walls
+from slice import Slice
+from enemy import Enemy, BigEnemy, SmallEnemy, TutorialEnemy
+from replay import Replay
+from particle import ChunkPool
+from spatial_index import HeightIndex
+from profiler import FrameProfiler
+import constants as c
+import helpers as h
+
+
+class SilentSound:
+    """ Stand-in for pygame.mixer.Sound when the simulation runs without audio. """
+
+    def play(self, *args, **kwargs):
+        pass
+
+    def stop(self):
+        pass
+
+    def set_volume(self, volume):
+        pass
+
+
+def init_headless():
+    """ Initializes pygame against the SDL dummy drivers, so entities that create or convert surfaces
+        can be constructed without opening a window.
+    """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    pygame.init()
+    if pygame.display.get_surface() is None:
+        pygame.display.set_mode((1, 1))
+
+
+class Simulation:
+    """ Game state and rules, independent of the window, the event queue and the wall clock.
+
+        Call step once per frame with the real time elapsed and the inputs received that frame.
+        Game renders on top of this; a Simulation on its own can be stepped headlessly.
+    """
+
+    sound_names = ["music", "explosion", "dash", "nope", "bounce", "wings_charged", "wings_used", "sus"]
+
+    def __init__(self):
+        for name in self.sound_names:
+            setattr(self, name, SilentSound())
+        self.tear_sounds = [SilentSound()]
+        self.bad_tear_sounds = [SilentSound()]
+
+        self.phase = c.TITLE
+        self.mouse_screen_position = (c.MIDDLE_X, c.MIDDLE_Y)
+        self.profiler = FrameProfiler()
+        self.reset_effects()
+
+    def reset_effects(self):
+        self.slowdown = 1.0
+        self.effect_slow = 1.0
+        self.since_effect = 1000
+        self.since_shake = 1000
+        self.shake_amp = 0
+        self.shake_frequency = 9
+        self.shake_offset = 0
+
+    def reset(self, seed=None):
+        """ Starts a new run. All randomness in the run is drawn from self.random, so two runs with
+            the same seed and the same inputs play out identically. A random seed is picked if
+            none is given.
+        """
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.replay = Replay(seed)
+
+        self.reset_effects()
+        self.phase = c.GAME_PHASE
+        self.y_offset = 0
+        self.player = Player(self)
+        self.walls = Walls(self)
+        self.slice = Slice(self)
+        self.enemies = HeightIndex([TutorialEnemy(self, y=c.WINDOW_HEIGHT/2, x=c.MIDDLE_X)])
+        self.enemies[0].angle = 0
+        self.update_enemies(0, [])
+        self.particles = []
+        self.chunks = ChunkPool(self)
+        self.text_particles = []
+        self.player.velocity = (100, 600)
+        self.aiming = False
+        self.aimingness = 0
+
+        self.score_yoff = 50
+        self.score_size = 40
+        self.target_score_size = 40
+        self.score_bumped = True
+
+        self.flare_alpha = 0
+        self.multiplier = 1
+        self.queue_reset = False
+        self.tutorial = True
+        self.tutorial_offset = 0
+
+    def launch_factor_multiplier(self):
+        if self.score() < 1000:
+            return 1
+        else:
+            return min(10, (self.score() - 1000)/4000 + 1)
+
+    def tear_sound(self):
+        random.choice(self.tear_sounds).play()
+        self.explosion.play()
+
+    def bad_tear_sound(self):
+        random.choice(self.tear_sounds).play()
+
+    def update_enemies(self, dt, events, n=10):
+        while len(self.enemies) < n:
+            if len(self.enemies) == 1:
+                spacing = int(c.WINDOW_HEIGHT*0.85)
+            else:
+                spacing = (c.WINDOW_HEIGHT//4) * (self.enemies[-1].y + 20000)/20000 \
+                          + self.random.random() * c.WINDOW_HEIGHT//3 \
+                          - c.WINDOW_HEIGHT//8
+            if spacing > c.WINDOW_HEIGHT*0.8:
+                spacing = c.WINDOW_HEIGHT*0.8
+            padding = 60
+            x = self.random.random()*(self.walls.width - 2 * padding) \
+                       + c.MIDDLE_X \
+                       - (self.walls.width - 2 * padding)/2
+            y = self.enemies[-1].y + spacing
+            roll = self.random.random()
+            if self.y_offset < 2000:
+                if roll < 0.3:
+                    new_enemy = Enemy
+                elif roll < 0.7:
+                    new_enemy = BigEnemy
+                else:
+                    new_enemy = SmallEnemy
+            elif self.y_offset < 5000:
+                if roll < 0.5:
+                    new_enemy = Enemy
+                elif roll < 0.7:
+                    new_enemy = BigEnemy
+                else:
+                    new_enemy = SmallEnemy
+            else:
+                if roll < 0.7:
+                    new_enemy = Enemy
+                elif roll < 0.8:
+                    new_enemy = BigEnemy
+                else:
+                    new_enemy = SmallEnemy
+            self.enemies.append(new_enemy(self, x=x, y=y))
+
+    def update_tutorial(self, dt, events):
+        if not self.tutorial:
+            return
+        if self.player.y > 150 and self.player.velocity[1] >= 0 or self.player.y > 60 and self.player.velocity[1] <= 0:
+            self.aiming = True
+            self.tutorial = False
+
+    def update_effects(self, dt, events):
+        if self.player_is_dead():
+            self.aiming = False
+            self.tutorial_offset += dt * 750
+
+        self.since_effect += dt
+        if self.since_effect > 0:
+            self.effect_slow = 1.0
+        else:
+            self.effect_slow = 0.01
+
+        self.since_shake += dt
+        self.shake_offset = self.shake_amp * math.cos(self.since_shake * self.shake_frequency * 2 * math.pi)
+        self.shake_amp *= 0.2**dt
+        self.shake_amp = max(self.shake_amp - 200*dt, 0)
+
+        self.flare_alpha *= 0.7**dt
+        self.flare_alpha -= 300 * dt
+        self.flare_alpha = max(0, self.flare_alpha)
+
+        if not self.queue_reset:
+            if self.score() % 1000 < 500 and not self.score_bumped:
+                self.score_bumped = True
+                self.score_size = 120
+                self.sus.play()
+            if self.score() % 1000 > 500 and self.score_bumped:
+                self.score_bumped = False
+
+        ds = self.target_score_size - self.score_size
+        if ds > 0:
+            self.score_size = min(self.score_size + ds * 5 * dt,
+                                  self.target_score_size)
+        else:
+            self.score_size = max(self.score_size + ds * 5 * dt,
+                                  self.target_score_size)
+
+        if self.queue_reset:
+            self.target_score_size = 80
+            dy = c.MIDDLE_Y - self.score_yoff
+            self.score_yoff = min(self.score_yoff + dy*5*dt, c.MIDDLE_Y - 100)
+
+    def score(self):
+        if not self.phase == c.GAME_PHASE:
+            return -1
+        return int(self.y_offset//10)
+
+    def slowdown_effect(self, duration = 0.4):
+        self.since_effect = -duration
+
+    def shake_effect(self, amplitude=20):
+        if amplitude < self.shake_amp:
+            return
+        self.since_shake = 0
+        self.shake_amp = max(amplitude, self.shake_amp)
+
+    def flare_up(self, amt):
+        self.flare_alpha = amt
+
+    def update_offset(self, dt, events):
+        max_off = c.WINDOW_HEIGHT*0.7
+        if self.player.y > self.y_offset + max_off and type(self.enemies[0]) is not TutorialEnemy:
+            self.y_offset = self.player.y - max_off
+
+    def update_aim(self, dt, events):
+        speed = 7
+        da = self.aiming - self.aimingness
+        self.aimingness += h.sign(da) * dt * speed
+        if self.aimingness > 1:
+            self.aimingness = 1
+        elif self.aimingness < 0:
+            self.aimingness = 0
+
+        self.slowdown = 1 - 0.95 * self.aimingness
+
+    def game_to_screen_y(self, y):
+        return c.WINDOW_HEIGHT - y + self.y_offset
+
+    def game_position_to_screen_position(self, pos):
+        x = pos[0] + self.shake_offset
+        y = self.game_to_screen_y(pos[1]) + self.shake_offset
+        return x, y
+
+    def screen_position_to_game_position(self, pos):
+        x = pos[0]
+        y = c.WINDOW_HEIGHT - pos[1] + self.y_offset
+        return x, y
+
+    def mouse_position(self):
+        return self.screen_position_to_game_position(self.mouse_screen_position)
+
+    def player_is_dead(self):
+        return self.player.y < self.y_offset - 50 and not self.player.flying and not self.player.has_wings
+
+    def handle_inputs(self, dt, inputs):
+        """ Applies one frame of player inputs, then returns dt scaled by the current slowdown. """
+        if self.phase == c.GAME_PHASE and self.player.y < self.y_offset - 100:
+            self.player.test_wings()
+        if self.phase == c.GAME_PHASE and self.player_is_dead():
+            self.queue_reset = True
+        for action in inputs:
+            if self.phase != c.GAME_PHASE:
+                continue
+            if action == c.RELEASE:
+                self.player.dash_toward(self.mouse_position(), 300)
+                self.aiming = False
+                self.aimingness = 0
+            elif action == c.PRESS and not self.player.cutting and not self.queue_reset:
+                self.aiming = True
+            elif action == c.GIVE_UP:
+                self.queue_reset = True
+        return dt * min(self.slowdown, self.effect_slow)
+
+    def step(self, rdt, inputs=(), mouse_position=None):
+        """ Advances the simulation by one frame of rdt real seconds. Inputs is a sequence of
+            PRESS, RELEASE and GIVE_UP actions, and mouse_position is the cursor in screen
+            coordinates. Returns the scaled time step that was applied to the world.
+        """
+        if mouse_position is not None:
+            self.mouse_screen_position = mouse_position
+        self.replay.record(rdt, inputs, self.mouse_screen_position)
+        events = []
+        profiler = self.profiler
+        dt = self.handle_inputs(rdt, inputs)
+        self.update_tutorial(dt, events)
+        profiler.mark("globals")
+        self.slice.update(rdt, events)
+        profiler.mark("slice")
+        self.update_effects(rdt, events)
+        profiler.mark("effects")
+        self.player.update(dt, events)
+        profiler.mark("player")
+        self.walls.update(dt, events)
+        profiler.mark("walls")
+        self.update_aim(dt, events)
+        self.update_offset(dt, events)
+        profiler.mark("effects")
+        self.update_enemies(dt, events)
+        for enemy in self.enemies.window(None, self.y_offset + 2*c.WINDOW_HEIGHT)[::-1]:
+            enemy.update(dt, events)
+        profiler.mark("enemies")
+        for particle in self.particles[::-1]:
+            particle.update(dt, events)
+        self.chunks.update(dt, events)
+        for particle in self.text_particles[::-1]:
+            particle.update(rdt, events)
+        profiler.mark("particles")
+        return dt
+
+    def run(self, frames, dt=c.SIM_DT):
+        """ Steps through an iterable of (inputs, mouse_position) frames at a fixed time step,
+            stopping early once the player dies. Returns the final score.
+        """
+        for inputs, mouse_position in frames:
+            self.step(dt, inputs, mouse_position)
+            if self.queue_reset:
+                break
+        return self.score()
@@ -1,6 +1,7 @@
 import pygame
+import numpy as np
 import constants as c
-import os
+import assets
 import math
 
 
@@ -9,9 +10,9 @@ class Slice:
     def __init__(self, game):
         self.game = game
         self.time = 0
-        self.touched = set()
-        self.pointer = pygame.image.load(os.path.join(c.ASSETS_PATH, "pointer.png"))
-        self.pointer_missing = pygame.image.load(os.path.join(c.ASSETS_PATH, "pointer_missing.png"))
+        self.touched = {}
+        self.pointer = assets.image("pointer.png")
+        self.pointer_missing = assets.image("pointer_missing.png")
 
     def update(self, dt, events):
         self.touched = self.enemies_touched()
@@ -63,34 +64,50 @@ class Slice:
         surface.blit(surf, (int(x - surf.get_width()//2), int(y - surf.get_height()//2)))
 
     def enemies_touched(self):
-        # return a set of all enemies within path
-        for enemy in self.game.enemies:
+        """ Returns the enemies the cut would pass through, as a dict of how far along the cut it
+            enters each one.
+        """
+        for enemy in self.touched:
             enemy.touched = False
         if not self.game.aiming:
-            self.touched = set()
+            self.touched = {}
             return self.touched
-        points = 25
         start_x = self.game.player.x
         start_y = self.game.player.y
         end_x, end_y = self.game.mouse_position()
         dx = end_x - start_x
         dy = end_y - start_y
         mag = (dx**2 + dy**2)**0.5
+        length = self.game.player.cut_distance
+
+        # Only lanterns in the band of heights the cut can reach
+        reach = self.game.enemies.max_radius
+        low = start_y - length - reach
+        high = min(start_y + length + reach, self.game.y_offset + 2*c.WINDOW_HEIGHT)
+        enemies = self.game.enemies.window(low, high)
+        if mag == 0 or not enemies:
+            self.touched = {}
+            return self.touched
         dxu = dx/mag
         dyu = dy/mag
-        enemies_touched = set()
-        for i in range(points):
-            distance = i/points * self.game.player.cut_distance
-            x = start_x + dxu*distance
-            y = start_y + dyu*distance
-            for enemy in self.game.enemies:
-                if enemy.y > self.game.y_offset + 2*c.WINDOW_HEIGHT:
-                    continue
-                dist = ((x - enemy.x)**2 + (y - enemy.y)**2)**0.5
-                if dist < enemy.radius:
-                    enemies_touched.add(enemy)
 
-        for enemy in enemies_touched:
+        # Closest approach of the cut segment to each enemy's center
+        circles = np.array([(enemy.x, enemy.y, enemy.radius) for enemy in enemies], dtype=float)
+        rel_x = circles[:, 0] - start_x
+        rel_y = circles[:, 1] - start_y
+        radius_sq = circles[:, 2]**2
+        along = rel_x*dxu + rel_y*dyu
+        closest = np.clip(along, 0, length)
+        hit = (rel_x - closest*dxu)**2 + (rel_y - closest*dyu)**2 < radius_sq
+
+        # Distance along the cut at which it first enters each circle
+        perp_sq = rel_x**2 + rel_y**2 - along**2
+        entry = np.maximum(along - np.sqrt(np.maximum(radius_sq - perp_sq, 0)), 0)
+
+        enemies_touched = {}
+        for index in np.flatnonzero(hit).tolist():
+            enemy = enemies[index]
+            enemies_touched[enemy] = float(entry[index])
             enemy.touch()
         self.touched = enemies_touched
         return enemies_touched
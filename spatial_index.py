@@ -0,0 +1,84 @@
+from bisect import bisect_left, bisect_right, insort
+
+
+__all__ = ["HeightIndex"]
+
+
+class HeightIndex:
+    """ Objects with a fixed y position, kept sorted by y so that horizontal bands of the world can be
+        found by bisection.
+
+        Objects are usually added in ascending y and expire from the bottom, so removing the lowest
+        object only moves a start offset instead of shifting the list. Supports the read-only parts
+        of the list interface (len, iteration, indexing and slicing) in ascending y order.
+    """
+
+    def __init__(self, items=()):
+        self.items = []
+        self.ys = []
+        self.head = 0
+        self.max_radius = 0
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        return len(self.items) - self.head
+
+    def __iter__(self):
+        return iter(self.items[self.head:])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.items[self.head:][index]
+        if not -len(self) <= index < len(self):
+            raise IndexError("HeightIndex index out of range")
+        return self.items[index] if index < 0 else self.items[self.head + index]
+
+    def __contains__(self, item):
+        return self.find(item) is not None
+
+    def append(self, item):
+        self.max_radius = max(self.max_radius, getattr(item, "radius", 0))
+        if not len(self):
+            self.compact()
+        if not self.ys or item.y >= self.ys[-1]:
+            self.items.append(item)
+            self.ys.append(item.y)
+        else:
+            index = bisect_right(self.ys, item.y, self.head)
+            self.items.insert(index, item)
+            insort(self.ys, item.y, self.head)
+
+    def find(self, item):
+        index = bisect_left(self.ys, item.y, self.head)
+        while index < len(self.ys) and self.ys[index] == item.y:
+            if self.items[index] is item:
+                return index
+            index += 1
+        return None
+
+    def remove(self, item):
+        index = self.find(item)
+        if index is None:
+            raise ValueError("HeightIndex.remove(item): item not in index")
+        if index == self.head:
+            self.items[index] = None
+            self.head += 1
+            if self.head > len(self.items)//2:
+                self.compact()
+        else:
+            del self.items[index]
+            del self.ys[index]
+
+    def compact(self):
+        del self.items[:self.head]
+        del self.ys[:self.head]
+        self.head = 0
+
+    def window(self, low=None, high=None):
+        """ Returns a list of the objects with low <= y <= high, in ascending y. Either bound can be
+            left as None to leave that side open.
+        """
+        start = self.head if low is None else bisect_left(self.ys, low, self.head)
+        end = len(self.ys) if high is None else bisect_right(self.ys, high, self.head)
+        return self.items[start:end]
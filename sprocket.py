@@ -1,12 +1,22 @@
+import asyncio
+import collections
 import socket
 import threading
-import pickle
 import struct
 import time
-import sys
 
+import wire
+import constants as c
 
-__all__ = ["Packet", "Servo", "Sprocket"]
+
+__all__ = ["AsyncServo", "ConnectionClosed", "FrameReader", "Packet", "Servo", "Sprocket", "send_frame"]
+
+
+frame_header = struct.Struct("!Q")     # payload size
+
+
+class ConnectionClosed(ConnectionError):
+    """ The other end closed the connection. """
 
 
 class Packet:
@@ -38,23 +48,98 @@ class Packet:
         return self.__dict__[index]
 
     def to_bytes(self):
-        """ Convert the packet to bytes via pickle. """
-        return pickle.dumps(self)
+        """ Convert the packet to bytes with the wire protocol. """
+        return wire.encode(self.__dict__)
 
     @staticmethod
     def from_bytes(data):
-        """ Construct and return a new packet from a pickle output. """
-        return pickle.loads(data)
+        """ Construct and return a new packet from wire protocol bytes. Raises ValueError if the
+            data isn't a valid packet.
+        """
+        return Packet(**wire.decode(data))
+
+
+class FrameReader:
+    """ Reads length-prefixed frames from a socket into one reusable buffer.
+
+        Each recv_into fills as much of the buffer as the socket has ready, so a burst of small
+        packets costs one system call rather than two per packet, and a large packet is received in
+        place instead of being joined from chunks. The buffer grows to fit the largest frame seen.
+    """
+
+    def __init__(self, sock, timeout=None, size=65536):
+        self.sock = sock
+        self.sock.settimeout(timeout)
+        self.buffer = bytearray(size)
+        self.start = 0
+        self.end = 0
+
+    def fill(self, n):
+        """ Receives until at least n unread bytes are buffered. """
+        if self.start + n > len(self.buffer):
+            unread = self.end - self.start
+            if n > len(self.buffer):
+                new_buffer = bytearray(max(n, 2 * len(self.buffer)))
+                new_buffer[:unread] = self.buffer[self.start:self.end]
+                self.buffer = new_buffer
+            else:
+                self.buffer[:unread] = self.buffer[self.start:self.end]
+            self.start = 0
+            self.end = unread
+        view = memoryview(self.buffer)
+        while self.end - self.start < n:
+            received = self.sock.recv_into(view[self.end:])
+            if not received:
+                raise ConnectionClosed("Connection closed by the other end.")
+            self.end += received
+
+    def read_frame(self):
+        """ Returns the next frame's payload as a memoryview of the buffer, which is only valid until
+            the next call. Raises ConnectionClosed if the socket closes, and socket.timeout if the
+            timeout passes without data.
+        """
+        self.fill(frame_header.size)
+        size = frame_header.unpack_from(self.buffer, self.start)[0]
+        self.start += frame_header.size
+        if size > c.MAX_PACKET_SIZE:
+            raise ValueError(f"Packet of {size} bytes is too large.")
+        self.fill(size)
+        payload = memoryview(self.buffer)[self.start:self.start + size]
+        self.start += size
+        return payload
+
+    def read_packet(self):
+        return Packet.from_bytes(self.read_frame())
+
+
+def send_frame(sock, payload):
+    """ Sends payload with its length prefix, as a single vectored send where the platform has one. """
+    header = frame_header.pack(len(payload))
+    if not hasattr(sock, "sendmsg"):
+        sock.sendall(header + payload)
+        return
+    buffers = [header, memoryview(payload)]
+    total = len(header) + len(payload)
+    sent = sock.sendmsg(buffers)
+    while sent < total:
+        # The socket took part of the frame; send the rest of it
+        if sent < len(header):
+            buffers = [header[sent:], memoryview(payload)]
+        else:
+            buffers = [memoryview(payload)[sent - len(header):]]
+        sent += sock.sendmsg(buffers)
 
 
 class Sprocket:
-    def __init__(self, host, port=41398):
+    def __init__(self, host, port=41398, timeout=None):
 
         # Establish socket connection and empty message queue
         self.sock = socket.socket(type=socket.SOCK_STREAM)
         self.sock.connect((host, port))
+        self.reader = FrameReader(self.sock, timeout)
         self.queue = []
         self.queue_mutex = threading.Lock()
+        self.error = None
 
         # Run thread to receive messages
         self.receive_thread = threading.Thread(target=self.continuously_receive_packets, daemon=True)
@@ -72,26 +157,25 @@ class Sprocket:
             but only acquires the queue mutex to add the new message.
         """
 
-        header = receive_exactly(self.sock, 8)
-        size = struct.unpack("!Q", header)[0]
-        data = receive_exactly(self.sock, size)
-        new_packet = Packet.from_bytes(data)
+        new_packet = self.reader.read_packet()
 
         with self.queue_mutex:
             self.queue.append(new_packet)
 
     def continuously_receive_packets(self):
-        """ Calls receive continuously. Wouldn't recommend calling, unless using threading. """
+        """ Calls receive continuously, until the connection closes or fails. The exception that
+            ended it is kept in error. Wouldn't recommend calling, unless using threading.
+        """
         while True:
-            self.receive_packet()
+            try:
+                self.receive_packet()
+            except (OSError, ValueError) as e:
+                self.error = e
+                self.sock.close()
+                return
 
     def send_packet(self, packet_object):
-        serialized = packet_object.to_bytes()
-        size = len(serialized)
-        header = struct.pack("!Q", size)
-
-        self.sock.sendall(header)
-        self.sock.sendall(serialized)
+        send_frame(self.sock, packet_object.to_bytes())
 
     def send(self, **kwargs):
         self.send_packet(Packet(**kwargs))
@@ -105,6 +189,7 @@ class Client:
         self.servo = servo
         self.client_id = servo.new_client_id()
         self.servo.id_to_client[self.client_id] = self
+        self.reader = FrameReader(conn, c.CLIENT_IDLE_TIMEOUT)
 
     def receive_packet(self):
         """ Receives a message from the socket, then appends it to the queue. This method is blocking,
@@ -113,10 +198,7 @@ class Client:
             Returns the message (bytes object).
         """
 
-        header = receive_exactly(self.conn, 8)
-        size = struct.unpack("!Q", header)[0]
-        data = receive_exactly(self.conn, size)
-        new_packet = Packet.from_bytes(data)
+        new_packet = self.reader.read_packet()
         new_packet.client_id = self.client_id
 
         with self.servo.queue_mutex:
@@ -126,15 +208,20 @@ class Client:
         while True:
             try:
                 self.receive_packet()
-            except ConnectionResetError:
-                self.servo.remove_client(self.client_id)
+            except socket.timeout:
+                print(f"Client {self.client_id} timed out.")
+            except ValueError as e:
+                print(f"Client {self.client_id} sent a bad packet: {e}")
+            except OSError:
+                pass
+            else:
+                continue
+            self.servo.remove_client(self.client_id)
+            self.conn.close()
+            return
 
     def send_packet(self, packet_object):
-        serialized = packet_object.to_bytes()
-        size = len(serialized)
-        header = struct.pack("!Q", size)
-        self.conn.sendall(header)
-        self.conn.sendall(serialized)
+        send_frame(self.conn, packet_object.to_bytes())
 
 
 class Servo:
@@ -197,7 +284,7 @@ class Servo:
                 client = self.id_to_client[client_id]
                 try:
                     client.send_packet(Packet(**kwargs))
-                except ConnectionResetError:
+                except OSError:
                     self.remove_client_no_mutex(client.client_id)
 
     def send_all(self, **kwargs):
@@ -222,16 +309,202 @@ class Servo:
         self.send(*all_client_ids, **kwargs)
 
 
-def receive_exactly(sock, n):
-    """ Receive exactly n bytes from the socket, then returns them. """
-    data = b''
-    sock.settimeout(2.0)
-    while n > 0:
+class AsyncClient:
+    """ A connection to an AsyncServo. Packets sent to it wait in outbox until its writer task gets
+        them onto the socket.
+    """
+
+    def __init__(self, reader, writer, servo):
+        self.start_time = time.time()
+        self.reader = reader
+        self.writer = writer
+        self.ip, self.port = writer.get_extra_info("peername")[:2]
+        self.servo = servo
+        self.client_id = servo.new_client_id()
+        self.outbox = collections.deque()
+        self.outbox_ready = asyncio.Event()
+
+    def enqueue(self, data):
+        """ Queues framed packet bytes. Returns False if the client isn't keeping up with its packets. """
+        if len(self.outbox) >= self.servo.queue_limit:
+            return False
+        self.outbox.append(data)
+        self.outbox_ready.set()
+        return True
+
+    async def receive_packets(self):
+        while True:
+            header = await asyncio.wait_for(self.reader.readexactly(frame_header.size),
+                                            self.servo.idle_timeout)
+            size = frame_header.unpack(header)[0]
+            if size > c.MAX_PACKET_SIZE:
+                raise ValueError(f"Packet of {size} bytes is too large.")
+            data = await asyncio.wait_for(self.reader.readexactly(size), self.servo.idle_timeout)
+            new_packet = Packet.from_bytes(data)
+            new_packet.client_id = self.client_id
+
+            with self.servo.queue_mutex:
+                self.servo.queue.append(new_packet)
+
+    async def send_packets(self):
+        while True:
+            await self.outbox_ready.wait()
+            self.outbox_ready.clear()
+            chunks = list(self.outbox)
+            self.outbox.clear()
+            self.writer.writelines(chunks)
+            # Waits while the socket's buffer is full, so a slow reader backs up into the outbox
+            await self.writer.drain()
+
+
+class AsyncServo:
+    """ Server with the same interface as Servo, serving every client from one asyncio event loop on
+        a background thread instead of a thread per client.
+
+        Sends are encoded once and queued per client, so one slow client doesn't hold up packets to
+        the others. A client with queue_limit packets still waiting to be written, or that sends
+        nothing for idle_timeout seconds, is disconnected.
+    """
+
+    def __init__(self, host="", port=41398, queue_limit=c.CLIENT_QUEUE_LIMIT,
+                 idle_timeout=c.CLIENT_IDLE_TIMEOUT, verbose=True):
+        self.queue_limit = queue_limit
+        self.idle_timeout = idle_timeout
+        self.verbose = verbose
+        self.id_to_client = {}
+        self.queue = []
+
+        self.queue_mutex = threading.Lock()
+        self.client_mutex = threading.Lock()
+
+        self.client_id_count = 0
+
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+        start = asyncio.start_server(self.serve_client, host or None, port, backlog=c.SERVER_BACKLOG)
+        self.server = asyncio.run_coroutine_threadsafe(start, self.loop).result()
+        self.log("Server initialized.")
+
+    @property
+    def clients(self):
+        with self.client_mutex:
+            return list(self.id_to_client.values())
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def new_client_id(self):
+        new = self.client_id_count
+        self.client_id_count += 1
+        return new
+
+    async def serve_client(self, reader, writer):
+        client = AsyncClient(reader, writer, self)
+        with self.client_mutex:
+            self.id_to_client[client.client_id] = client
+        self.log(f"Client {client.client_id} joined with ip {client.ip}")
+        sender = asyncio.ensure_future(client.send_packets())
         try:
-            chunk = sock.recv(n)
-        except:
-            print("Socket timeout")
-            sys.exit(0)
-        n -= len(chunk)
-        data += chunk
-    return data
+            await client.receive_packets()
+        except asyncio.TimeoutError:
+            self.log(f"Client {client.client_id} timed out.")
+        except ValueError as e:
+            self.log(f"Client {client.client_id} sent a bad packet: {e}")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            sender.cancel()
+            self.disconnect(client)
+
+    def disconnect(self, client):
+        """ Closes a client's connection. Only call from the event loop. """
+        with self.client_mutex:
+            if self.id_to_client.get(client.client_id) is not client:
+                return
+            del self.id_to_client[client.client_id]
+        client.writer.close()
+        self.log(f"Client {client.client_id} at ip {client.ip} disconnected.")
+
+    def get(self):
+        """ Returns the list of packets currently in the queue. """
+        with self.queue_mutex:
+            response = self.queue[:]
+            self.queue = []
+        return response
+
+    def remove_client(self, client_id):
+        with self.client_mutex:
+            client = self.id_to_client.get(client_id)
+        if client is not None:
+            self.loop.call_soon_threadsafe(self.disconnect, client)
+
+    def enqueue(self, client_ids, data):
+        for client_id in client_ids:
+            client = self.id_to_client.get(client_id)
+            if client is not None and not client.enqueue(data):
+                self.log(f"Client {client_id} isn't reading its packets.")
+                self.disconnect(client)
+
+    def send(self, *client_ids, **kwargs):
+        """ Sends a packet consisting of the information in kwargs to each client id specified.
+            Returns without waiting for the packet to be written. Client ids that have disconnected
+            are skipped.
+        """
+        serialized = Packet(**kwargs).to_bytes()
+        data = frame_header.pack(len(serialized)) + serialized
+        self.loop.call_soon_threadsafe(self.enqueue, client_ids, data)
+
+    def send_encoded(self, packets):
+        """ Sends packets that are already encoded, as a list of (client id, bytes) pairs, with a
+            single wakeup of the event loop.
+        """
+        frames = [((client_id,), frame_header.pack(len(data)) + data) for client_id, data in packets]
+        if frames:
+            self.loop.call_soon_threadsafe(self.enqueue_all, frames)
+
+    def enqueue_all(self, frames):
+        for client_ids, data in frames:
+            self.enqueue(client_ids, data)
+
+    def send_all(self, **kwargs):
+        """ Sends a packet consisting of the information in kwargs to all clients."""
+        with self.client_mutex:
+            client_ids = list(self.id_to_client)
+        self.send(*client_ids, **kwargs)
+
+    def send_all_but(self, *client_ids, **kwargs):
+        """ Sends a packet consisting of the information in kwargs to each client id except those specified. """
+        with self.client_mutex:
+            all_client_ids = [key for key in self.id_to_client if key not in client_ids]
+        self.send(*all_client_ids, **kwargs)
+
+    def close(self):
+        """ Stops accepting connections, disconnects every client and stops the event loop. """
+        async def shut_down():
+            self.server.close()
+            for client in self.clients:
+                self.disconnect(client)
+            # Closed connections end their serve_client tasks, which cancel their own senders
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            if tasks:
+                await asyncio.wait(tasks, timeout=1.0)
+            await self.server.wait_closed()
+        asyncio.run_coroutine_threadsafe(shut_down(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+
+
+def receive_exactly(sock, n):
+    """ Receive exactly n bytes from the socket, then returns them. Raises ConnectionClosed if the
+        socket closes first.
+    """
+    data = bytearray(n)
+    view = memoryview(data)
+    while view:
+        received = sock.recv_into(view)
+        if not received:
+            raise ConnectionClosed("Connection closed by the other end.")
+        view = view[received:]
+    return bytes(data)
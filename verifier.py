@@ -0,0 +1,112 @@
+import multiprocessing
+import signal
+import struct
+import time
+
+from replay import Replay
+import constants as c
+
+
+__all__ = ["ScoreVerifier"]
+
+
+# Each worker process keeps one headless simulation around and reuses it for every replay
+worker_simulation = None
+
+
+def init_worker():
+    global worker_simulation
+    from simulation import Simulation, init_headless
+    init_headless()
+    # pygame's SDL installs a SIGTERM handler, which would keep Pool.terminate from working
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    worker_simulation = Simulation()
+
+
+def verify_replay(data, claimed_score, max_frames, queue_deadline, budget):
+    """ Re-simulates a serialized replay and returns True if it reaches exactly the claimed score.
+        Returns None if the replay waited in the queue past queue_deadline, or isn't done budget
+        seconds after the worker started on it, since it was never judged either way.
+    """
+    start = time.time()
+    if start > queue_deadline:
+        return None
+    try:
+        # The header alone is enough to turn away replays that are too long, without parsing them
+        _, count = Replay.read_header(data)
+        if count > max_frames:
+            return False
+        replay = Replay.from_bytes(data)
+    except (ValueError, struct.error):
+        return False
+    score = replay.play(worker_simulation, deadline=start + budget)
+    if score is None:
+        return None
+    return score == claimed_score
+
+
+class ScoreVerifier:
+    """ Checks submitted scores against their replays in a pool of worker processes.
+
+        Submissions never block; call finished regularly to collect verdicts. Each replay may wait
+        up to queue_timeout seconds for a worker, and then gets timeout seconds plus one second per
+        frame_rate frames, counted from when the worker starts on it. Replays that run out of time
+        have no verdict, rather than counting as rejected, and so do submissions made while
+        queue_limit replays are already waiting.
+    """
+
+    def __init__(self, workers=None, timeout=c.VERIFY_TIMEOUT, max_frames=c.MAX_REPLAY_FRAMES,
+                 frame_rate=c.VERIFY_FRAME_RATE, queue_timeout=c.VERIFY_QUEUE_TIMEOUT,
+                 queue_limit=c.VERIFY_QUEUE_LIMIT):
+        self.timeout = timeout
+        self.max_frames = max_frames
+        self.frame_rate = frame_rate
+        self.queue_timeout = queue_timeout
+        self.queue_limit = queue_limit
+        self.pool = multiprocessing.Pool(workers, initializer=init_worker)
+        self.pending = []
+
+    def budget(self, frames):
+        """ Returns the seconds a worker may spend re-simulating a replay of this many frames. """
+        return self.timeout + min(frames, self.max_frames) / self.frame_rate
+
+    def submit(self, replay_data, claimed_score, context=None):
+        """ Queues a replay for verification. Context is handed back unchanged by finished. Returns
+            False, without queuing it, if too many replays are already waiting.
+        """
+        if len(self.pending) >= self.queue_limit:
+            return False
+        try:
+            _, frames = Replay.read_header(replay_data)
+        except (ValueError, struct.error, TypeError):
+            # The worker rejects it straight away
+            frames = 0
+        now = time.time()
+        budget = self.budget(frames)
+        queue_deadline = now + self.queue_timeout
+        result = self.pool.apply_async(verify_replay, (replay_data, claimed_score, self.max_frames,
+                                                       queue_deadline, budget))
+        # A worker that crashes never answers, so the job is given up on once it can't still be running
+        self.pending.append((queue_deadline + budget + 1.0, result, context))
+        return True
+
+    def finished(self):
+        """ Returns a list of (context, verdict) for every submission that completed or expired since
+            the last call. The verdict is True or False, or None if the replay ran out of time.
+        """
+        now = time.time()
+        done = []
+        still_pending = []
+        for expires, result, context in self.pending:
+            if result.ready():
+                done.append((context, result.get() if result.successful() else False))
+            elif now > expires:
+                done.append((context, None))
+            else:
+                still_pending.append((expires, result, context))
+        self.pending = still_pending
+        return done
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
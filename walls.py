@@ -1,6 +1,6 @@
 import pygame
 import constants as c
-import os
+import assets
 
 class Walls:
 
@@ -8,10 +8,14 @@ class Walls:
         self.game = game
         self.width = 360
         self.target_width = self.width
-        self.texture = pygame.image.load(os.path.join(c.ASSETS_PATH, "wall_texture.png"))
+        self.texture = assets.image("wall_texture.png")
         self.right_texture = pygame.transform.flip(self.texture, 1, 0)
 
     def update(self, dt, events):
+        if self.game.y_offset > 15000:
+            self.target_width = 500
+        if self.game.y_offset > 30000:
+            self.target_width = 640
         dw = self.target_width - self.width
         p = 5
         if dw > 0:
@@ -22,10 +26,6 @@ class Walls:
     def draw(self, surface):
         color = c.BLACK
         padding = 100
-        if self.game.y_offset > 15000:
-            self.target_width = 500
-        if self.game.y_offset > 30000:
-            self.target_width = 640
         rect_width = c.MIDDLE_X - self.width//2
         pygame.draw.rect(surface,
                          color,
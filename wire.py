@@ -0,0 +1,288 @@
+""" Binary encoding of sprocket packets.
+
+    Every message starts with a header naming the protocol version, the message's schema and the
+    request id the message belongs to, if any (the request_id field, a positive 32 bit int). The
+    known messages (score pushes, scoreboard requests, push results, scoreboards, and scoreboard
+    syncs and their changes) are packed field by field. Anything else is written with the generic schema, which tags each value with its
+    type and supports None, bools, ints, floats, strings, bytes, lists, dicts and scoreboards.
+
+    Unlike pickle, decoding can only ever produce those types, so it's safe to use on data from
+    untrusted clients.
+"""
+
+import struct
+
+from scoreboard import Score, Scoreboard
+
+
+__all__ = ["encode", "decode", "readdress"]
+
+
+magic = b"LMPK"
+version = 2
+header = struct.Struct("!4sBBI")        # magic, version, schema, request id or 0
+request_id_offset = struct.calcsize("!4sBB")
+request_id_field = struct.Struct("!I")
+length = struct.Struct("!I")
+push_fields = struct.Struct("!qH")      # score, name length; followed by the name and optional replay
+board_fields = struct.Struct("!IIQI")   # visible rows, max rows, index count, row count
+row_fields = struct.Struct("!qqH")      # index, score, name length; followed by the name
+sync_fields = struct.Struct("!QHqH")    # since, top, score, name length; followed by the name
+delta_fields = struct.Struct("!QqI")    # version, rank or -1, row count; followed by the rows
+int_value = struct.Struct("!q")
+float_value = struct.Struct("!d")
+bool_value = struct.Struct("!?")
+
+GENERIC = 0
+PUSH = 1
+PRINT = 2
+SUCCESS = 3
+SCORES = 4
+SYNC = 5
+DELTA = 6
+
+NO_REPLAY = 0xFFFFFFFF
+
+
+def encode(fields):
+    """ Returns the bytes of a message with the given fields. """
+    request_id = fields.get("request_id")
+    if type(request_id) is int and 0 < request_id <= 0xFFFFFFFF:
+        fields = {key: value for key, value in fields.items() if key != "request_id"}
+    else:
+        request_id = 0
+    schema = schema_of(fields)
+    chunks = [header.pack(magic, version, schema, request_id)]
+    if schema == PUSH:
+        name = fields["name"].encode("utf-8")
+        chunks.append(push_fields.pack(fields["score"], len(name)))
+        chunks.append(name)
+        replay = fields.get("replay")
+        chunks.append(length.pack(NO_REPLAY if replay is None else len(replay)))
+        if replay is not None:
+            chunks.append(replay)
+    elif schema == SUCCESS:
+        chunks.append(bool_value.pack(fields["success"]))
+    elif schema == SCORES:
+        encode_board(fields["scores"], chunks)
+    elif schema == SYNC:
+        name = fields["name"].encode("utf-8")
+        chunks.append(sync_fields.pack(fields["since"], fields["top"], fields["score"], len(name)))
+        chunks.append(name)
+    elif schema == DELTA:
+        rank = fields["rank"]
+        chunks.append(delta_fields.pack(fields["version"], -1 if rank is None else rank,
+                                        len(fields["scores"])))
+        encode_rows(fields["scores"], chunks)
+    elif schema == GENERIC:
+        encode_value(fields, chunks)
+    return b"".join(chunks)
+
+
+def decode(data):
+    """ Returns the fields of a message. Raises ValueError if the data isn't a valid message. """
+    try:
+        data = memoryview(data)
+        magic_read, version_read, schema, request_id = header.unpack_from(data)
+        if magic_read != magic or version_read != version:
+            raise ValueError("Not a packet, or a packet from an incompatible version.")
+        offset = header.size
+        if schema == PUSH:
+            score, name_length = push_fields.unpack_from(data, offset)
+            offset += push_fields.size
+            name = decode_str(data[offset:offset + name_length])
+            offset += name_length
+            fields = {"type": "push", "score": score, "name": name}
+            replay_length, = length.unpack_from(data, offset)
+            offset += length.size
+            if replay_length != NO_REPLAY:
+                fields["replay"] = bytes(data[offset:offset + replay_length])
+                offset += replay_length
+        elif schema == PRINT:
+            fields = {"type": "print"}
+        elif schema == SUCCESS:
+            fields = {"success": bool_value.unpack_from(data, offset)[0]}
+            offset += bool_value.size
+        elif schema == SCORES:
+            board, offset = decode_board(data, offset)
+            fields = {"scores": board}
+        elif schema == SYNC:
+            since, top, score, name_length = sync_fields.unpack_from(data, offset)
+            offset += sync_fields.size
+            name = decode_str(data[offset:offset + name_length])
+            offset += name_length
+            fields = {"type": "sync", "since": since, "top": top, "name": name, "score": score}
+        elif schema == DELTA:
+            version_read, rank, count = delta_fields.unpack_from(data, offset)
+            offset += delta_fields.size
+            scores, offset = decode_rows(data, offset, count)
+            fields = {"version": version_read, "scores": scores, "rank": None if rank < 0 else rank}
+        elif schema == GENERIC:
+            fields, offset = decode_value(data, offset)
+            if not isinstance(fields, dict):
+                raise ValueError("Generic packet fields aren't a dict.")
+        else:
+            raise ValueError(f"Unknown packet schema {schema}.")
+    except (struct.error, UnicodeDecodeError, RecursionError) as e:
+        raise ValueError(f"Malformed packet: {e}") from e
+    if offset != len(data):
+        raise ValueError("Packet is longer than its fields.")
+    if request_id:
+        fields["request_id"] = request_id
+    return fields
+
+
+def readdress(data, request_id):
+    """ Returns a copy of an encoded message that answers another request, so that one encoding can
+        be sent to many clients.
+    """
+    if not (type(request_id) is int and 0 < request_id <= 0xFFFFFFFF):
+        request_id = 0
+    return b"".join((data[:request_id_offset], request_id_field.pack(request_id), data[header.size:]))
+
+
+def schema_of(fields):
+    """ Returns the schema that can pack these fields exactly, falling back on GENERIC. """
+    kind = fields.get("type")
+    keys = set(fields)
+    if kind == "push" and keys in ({"type", "score", "name"}, {"type", "score", "name", "replay"}):
+        if (fits(fields["score"], -2**63, 2**63)
+                and isinstance(fields["name"], str) and len(fields["name"].encode("utf-8")) <= 0xFFFF
+                and isinstance(fields.get("replay", b""), (bytes, bytearray))):
+            return PUSH
+    elif kind == "print" and keys == {"type"}:
+        return PRINT
+    elif keys == {"success"} and type(fields["success"]) is bool:
+        return SUCCESS
+    elif keys == {"scores"} and isinstance(fields["scores"], Scoreboard):
+        return SCORES
+    elif kind == "sync" and keys == {"type", "since", "top", "name", "score"}:
+        if (fits(fields["since"], 0, 2**64) and fits(fields["top"], 0, 2**16)
+                and fits(fields["score"], -2**63, 2**63)
+                and isinstance(fields["name"], str) and len(fields["name"].encode("utf-8")) <= 0xFFFF):
+            return SYNC
+    elif keys == {"version", "scores", "rank"}:
+        if (fits(fields["version"], 0, 2**64) and (fields["rank"] is None or fits(fields["rank"], 0, 2**63))
+                and isinstance(fields["scores"], list) and len(fields["scores"]) <= 0xFFFFFFFF
+                and all(isinstance(item, Score) for item in fields["scores"])):
+            return DELTA
+    return GENERIC
+
+
+def fits(value, low, high):
+    """ Whether value is an int in [low, high). """
+    return type(value) is int and low <= value < high
+
+
+def decode_str(data):
+    return str(data, "utf-8")
+
+
+def encode_rows(scores, chunks):
+    for item in scores:
+        name = item.name.encode("utf-8")
+        chunks.append(row_fields.pack(item.index, item.score, len(name)))
+        chunks.append(name)
+
+
+def decode_rows(data, offset, count):
+    """ Returns count scores read from offset, and the offset after them. """
+    scores = []
+    for _ in range(count):
+        index, score, name_length = row_fields.unpack_from(data, offset)
+        offset += row_fields.size
+        scores.append(Score(decode_str(data[offset:offset + name_length]), score, index))
+        offset += name_length
+    return scores, offset
+
+
+def encode_board(board, chunks):
+    chunks.append(board_fields.pack(board.visible_rows, board.max_rows, board.index_count,
+                                    len(board.data)))
+    encode_rows(board.data, chunks)
+
+
+def decode_board(data, offset):
+    visible_rows, max_rows, index_count, count = board_fields.unpack_from(data, offset)
+    offset += board_fields.size
+    scores, offset = decode_rows(data, offset, count)
+    board = Scoreboard.__new__(Scoreboard)
+    board.visible_rows = visible_rows
+    board.max_rows = max_rows
+    board.restore(scores, index_count)
+    return board, offset
+
+
+def encode_value(value, chunks):
+    if value is None:
+        chunks.append(b"N")
+    elif isinstance(value, bool):
+        chunks.append(b"T" if value else b"F")
+    elif isinstance(value, int):
+        chunks.append(b"i")
+        chunks.append(int_value.pack(value))
+    elif isinstance(value, float):
+        chunks.append(b"f")
+        chunks.append(float_value.pack(value))
+    elif isinstance(value, str):
+        encoded = value.encode("utf-8")
+        chunks.append(b"s")
+        chunks.append(length.pack(len(encoded)))
+        chunks.append(encoded)
+    elif isinstance(value, (bytes, bytearray)):
+        chunks.append(b"b")
+        chunks.append(length.pack(len(value)))
+        chunks.append(bytes(value))
+    elif isinstance(value, (list, tuple)):
+        chunks.append(b"l")
+        chunks.append(length.pack(len(value)))
+        for item in value:
+            encode_value(item, chunks)
+    elif isinstance(value, dict):
+        chunks.append(b"d")
+        chunks.append(length.pack(len(value)))
+        for key, item in value.items():
+            encode_value(str(key), chunks)
+            encode_value(item, chunks)
+    elif isinstance(value, Scoreboard):
+        chunks.append(b"B")
+        encode_board(value, chunks)
+    else:
+        raise TypeError(f"Can't send a value of type {type(value).__name__} in a packet.")
+
+
+def decode_value(data, offset):
+    """ Returns the value at offset and the offset after it. """
+    tag = bytes(data[offset:offset + 1])
+    offset += 1
+    if tag == b"N":
+        return None, offset
+    if tag in (b"T", b"F"):
+        return tag == b"T", offset
+    if tag == b"i":
+        return int_value.unpack_from(data, offset)[0], offset + int_value.size
+    if tag == b"f":
+        return float_value.unpack_from(data, offset)[0], offset + float_value.size
+    if tag in (b"s", b"b", b"l", b"d"):
+        count, = length.unpack_from(data, offset)
+        offset += length.size
+        if tag == b"s":
+            return decode_str(data[offset:offset + count]), offset + count
+        if tag == b"b":
+            return bytes(data[offset:offset + count]), offset + count
+        if tag == b"l":
+            items = []
+            for _ in range(count):
+                item, offset = decode_value(data, offset)
+                items.append(item)
+            return items, offset
+        items = {}
+        for _ in range(count):
+            key, offset = decode_value(data, offset)
+            if not isinstance(key, str):
+                raise ValueError("Packet dict keys must be strings.")
+            items[key], offset = decode_value(data, offset)
+        return items, offset
+    if tag == b"B":
+        return decode_board(data, offset)
+    raise ValueError(f"Unknown value tag {tag!r}.")